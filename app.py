@@ -1,47 +1,1048 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, session, flash, make_response
+from flask import Flask, request, jsonify, render_template, redirect, url_for, session, flash, make_response, Response, stream_with_context, g
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.exceptions import ReadTimeoutError
 import json
+import asyncio
+import inspect
+import importlib.metadata
+import sys
 import sqlite3
 import os
 import re
-from functools import wraps
+import math
+from functools import wraps, lru_cache
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from itertools import repeat
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
 import uuid
-from datetime import datetime
+import hashlib
+from datetime import datetime, timezone
+import threading
+import queue
+import time
+import random
+import statistics
+import click
+import aiohttp
+from asgiref.sync import sync_to_async
+import numpy as np
 import textstat
 import nltk
 from nltk.sentiment import SentimentIntensityAnalyzer
 from docx import Document
-import pdfkit
 from io import BytesIO
 import base64
-from docx2pdf import convert
+import bisect
+import heapq
 import tempfile
+import zipfile
 
-
-# Download NLTK resources
-try:
-    nltk.data.find('vader_lexicon')
-except LookupError:
-    nltk.download('vader_lexicon')
-
+from flask.signals import request_started
 from flask_wtf.csrf import CSRFProtect
+from jinja2 import Environment
+from markupsafe import Markup, escape
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'your_default_secret_key')
 csrf = CSRFProtect(app)
 
 # LM Studio API configuration
-LM_STUDIO_API_URL = "http://localhost:1234/v1/chat/completions"
+LM_STUDIO_API_URL = os.environ.get('LM_STUDIO_API_URL', "http://localhost:1234/v1/chat/completions")
+LM_STUDIO_CONNECT_TIMEOUT = float(os.environ.get('LM_STUDIO_CONNECT_TIMEOUT', 5))
+LM_STUDIO_READ_TIMEOUT = float(os.environ.get('LM_STUDIO_READ_TIMEOUT', 120))
+LM_STUDIO_MAX_RETRIES = int(os.environ.get('LM_STUDIO_MAX_RETRIES', 2))
+LM_STUDIO_RETRY_BACKOFF = float(os.environ.get('LM_STUDIO_RETRY_BACKOFF', 0.5))
+LM_STUDIO_POOL_SIZE = int(os.environ.get('LM_STUDIO_POOL_SIZE', 10))
+# Connections for async views; requests beyond this wait on the event loop, not on threads
+LM_STUDIO_ASYNC_POOL_SIZE = int(os.environ.get('LM_STUDIO_ASYNC_POOL_SIZE', 100))
+LM_STUDIO_BREAKER_THRESHOLD = int(os.environ.get('LM_STUDIO_BREAKER_THRESHOLD', 5))
+LM_STUDIO_BREAKER_COOLDOWN = float(os.environ.get('LM_STUDIO_BREAKER_COOLDOWN', 30))
+
+class LLMServiceUnavailable(Exception):
+    """Raised when the model server is unreachable or the circuit breaker is open"""
+
+class LLMTimeout(LLMServiceUnavailable):
+    """Raised when a model server took the request but didn't answer in time; another server would only run it again"""
+
+class LLMQueueFull(LLMServiceUnavailable):
+    """Raised when the LLM scheduler turns a request away, with the HTTP status and Retry-After to send"""
+    
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Fail fast after repeated upstream failures, then let one probe through after a cooldown"""
+    
+    def __init__(self, failure_threshold, cooldown):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+    
+    def before_call(self):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown:
+                raise LLMServiceUnavailable("LM Studio is unavailable, please try again shortly")
+            # Half-open: allow this call through as a probe and re-open on failure
+            self.opened_at = time.monotonic()
+    
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+    
+    def is_open(self):
+        """True while calls are being refused, i.e. open and still cooling down"""
+        opened_at = self.opened_at
+        return opened_at is not None and time.monotonic() - opened_at < self.cooldown
+
+class LLMClient:
+    """Shared keep-alive HTTP client for the LM Studio API"""
+    
+    def __init__(self, url, breaker=None):
+        self.url = url
+        self.timeout = (LM_STUDIO_CONNECT_TIMEOUT, LM_STUDIO_READ_TIMEOUT)
+        self.breaker = breaker or CircuitBreaker(LM_STUDIO_BREAKER_THRESHOLD, LM_STUDIO_BREAKER_COOLDOWN)
+        
+        # Retry connection failures and gateway errors, but never a read timeout:
+        # a generation that timed out would just time out again
+        retry = Retry(
+            total=LM_STUDIO_MAX_RETRIES,
+            connect=LM_STUDIO_MAX_RETRIES,
+            read=0,
+            status=LM_STUDIO_MAX_RETRIES,
+            backoff_factor=LM_STUDIO_RETRY_BACKOFF,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'POST']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LM_STUDIO_POOL_SIZE, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": "application/json"})
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+    
+    def post(self, data, stream=False):
+        """POST a request body, returning the response or raising on failure"""
+        self.breaker.before_call()
+        try:
+            response = self.session.post(self.url, data=json.dumps(data), timeout=self.timeout, stream=stream)
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            # Once Retry has given up, a read timeout arrives as a ConnectionError wrapping urllib3's error
+            reason = getattr(e.args[0], 'reason', None) if e.args else None
+            if isinstance(e, requests.ReadTimeout) or isinstance(reason, ReadTimeoutError):
+                raise LLMTimeout(f"LM Studio did not answer in time: {str(e)}")
+            raise LLMServiceUnavailable(f"Could not reach LM Studio: {str(e)}")
+        
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        
+        if response.status_code != 200:
+            text = response.text
+            response.close()
+            if response.status_code >= 500:
+                # e.g. 503 while the model is unloaded; another server may have it loaded
+                raise LLMServiceUnavailable(f"LM Studio error {response.status_code}: {text}")
+            raise Exception(f"Error {response.status_code}: {text}")
+        return response
+
+class AsyncLLMClient:
+    """Non-blocking LM Studio client for async views, sharing the blocking client's circuit breaker"""
+    
+    def __init__(self, url, breaker):
+        self.url = url
+        self.breaker = breaker
+        # connect also bounds the wait for a free pooled connection
+        self.timeout = aiohttp.ClientTimeout(connect=LM_STUDIO_READ_TIMEOUT, sock_connect=LM_STUDIO_CONNECT_TIMEOUT,
+                                             sock_read=LM_STUDIO_READ_TIMEOUT)
+        self.session = None
+    
+    def make_session(self):
+        return aiohttp.ClientSession(timeout=self.timeout, headers={"Content-Type": "application/json"},
+                                     connector=aiohttp.TCPConnector(limit=LM_STUDIO_ASYNC_POOL_SIZE))
+    
+    async def open(self):
+        """Share one keep-alive session across the ASGI server's event loop"""
+        self.session = self.make_session()
+    
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+    
+    async def post(self, data, json_object=False):
+        """POST a request body, returning the decoded response or raising on failure.
+        
+        With json_object the request must stream, and the result is the reply's first JSON object,
+        read only up to its closing brace.
+        """
+        if self.session is not None:
+            return await self.send(self.session, data, json_object)
+        # Under a WSGI server every async view runs in its own short-lived event loop
+        async with self.make_session() as session:
+            return await self.send(session, data, json_object)
+    
+    async def send(self, session, data, json_object=False):
+        self.breaker.before_call()
+        body = json.dumps(data)
+        
+        # Same policy as LLMClient: retry connection failures and gateway errors, never a read timeout
+        for attempt in range(LM_STUDIO_MAX_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(LM_STUDIO_RETRY_BACKOFF * 2 ** (attempt - 1))
+            try:
+                async with session.post(self.url, data=body) as response:
+                    status = response.status
+                    if status == 200 and json_object:
+                        # Leaving the block early drops the connection, which stops the generation
+                        text = await read_json_object_async(iter_stream_deltas_async(response.content))
+                    else:
+                        text = await response.text()
+            except (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError) as e:
+                if attempt < LM_STUDIO_MAX_RETRIES:
+                    continue
+                self.breaker.record_failure()
+                raise LLMServiceUnavailable(f"Could not reach LM Studio: {str(e)}")
+            except asyncio.TimeoutError as e:
+                self.breaker.record_failure()
+                raise LLMTimeout(f"LM Studio did not answer in time: {str(e) or type(e).__name__}")
+            except aiohttp.ClientError as e:
+                self.breaker.record_failure()
+                raise LLMServiceUnavailable(f"Could not reach LM Studio: {str(e) or type(e).__name__}")
+            if status not in (502, 503, 504) or attempt == LM_STUDIO_MAX_RETRIES:
+                break
+        
+        if status >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        
+        if status >= 500:
+            raise LLMServiceUnavailable(f"LM Studio error {status}: {text}")
+        if status != 200:
+            raise Exception(f"Error {status}: {text}")
+        return text if json_object else json.loads(text)
+
+# Model servers. LLM_BACKENDS is a JSON list of {"name", "url", "model", "tasks"} objects; a backend
+# without "tasks" serves every task. Without it, the single LM Studio server above is used.
+LM_STUDIO_MODEL = os.environ.get('LM_STUDIO_MODEL', 'mistral-7b-instruct-v0.3:2')
+LLM_BACKENDS = json.loads(os.environ.get('LLM_BACKENDS') or 'null') or [
+    {'name': 'lm-studio', 'url': LM_STUDIO_API_URL, 'model': LM_STUDIO_MODEL}
+]
+LLM_HEALTH_INTERVAL = float(os.environ.get('LLM_HEALTH_INTERVAL', 10))
+
+class LLMBackend:
+    """One OpenAI-compatible model server, with its own clients, circuit breaker and load counters"""
+    
+    def __init__(self, url, model, name=None, tasks=None):
+        self.name = name or url
+        self.url = url
+        self.model = model
+        self.tasks = frozenset(tasks) if tasks else None
+        self.health_url = url.rsplit('/chat/completions', 1)[0] + '/models'
+        self.breaker = CircuitBreaker(LM_STUDIO_BREAKER_THRESHOLD, LM_STUDIO_BREAKER_COOLDOWN)
+        self.client = LLMClient(url, self.breaker)
+        self.async_client = AsyncLLMClient(url, self.breaker)
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+    
+    def affinity(self, task):
+        """0 for a backend dedicated to the task, 1 for a general one, 2 for one that doesn't serve it"""
+        if self.tasks is None:
+            return 1
+        return 0 if task in self.tasks else 2
+    
+    def serves(self, task):
+        return self.affinity(task) < 2
+    
+    def check_health(self):
+        try:
+            self.healthy = requests.get(self.health_url, timeout=LM_STUDIO_CONNECT_TIMEOUT).status_code == 200
+        except requests.RequestException:
+            self.healthy = False
+    
+    def get_stats(self):
+        return {
+            'name': self.name,
+            'model': self.model,
+            'tasks': sorted(self.tasks) if self.tasks else None,
+            'healthy': self.healthy,
+            'breaker_open': self.breaker.is_open(),
+            'outstanding': self.outstanding,
+            'requests': self.requests
+        }
+
+class LLMRouter:
+    """Routes each request to a backend for its task.
+    
+    Among healthy backends that serve the task, the one with the fewest outstanding requests wins,
+    with ties going to a backend dedicated to the task. Backends that don't serve the task, then
+    unhealthy ones, are only tried as a last resort, and unreachable ones are skipped in turn.
+    """
+    
+    def __init__(self, backends, health_interval):
+        self.backends = backends
+        self.health_interval = health_interval
+        self.lock = threading.Lock()
+        self.thread = None
+    
+    def model_for(self, task):
+        """The model a task's requests are built and cached for"""
+        return min(self.backends, key=lambda backend: backend.affinity(task)).model
+    
+    def choose(self, task, tried):
+        with self.lock:
+            candidates = [backend for backend in self.backends if backend not in tried and not backend.breaker.is_open()]
+            if not candidates:
+                raise LLMServiceUnavailable("No model server is available, please try again shortly")
+            backend = min(candidates, key=lambda backend: (
+                not backend.healthy, not backend.serves(task), backend.outstanding, backend.affinity(task), backend.requests
+            ))
+            backend.outstanding += 1
+            backend.requests += 1
+        return backend
+    
+    def finish(self, backend):
+        with self.lock:
+            backend.outstanding -= 1
+    
+    def post(self, data, task, stream=False):
+        """POST to a backend, failing over while backends are unreachable or answer with a server error.
+        
+        A read timeout is raised as is: the backend was generating, and another one would start over.
+        Returns (backend, response); the caller must pass the backend to finish() once the response is read.
+        """
+        tried = []
+        while True:
+            try:
+                backend = self.choose(task, tried)
+            except LLMServiceUnavailable:
+                if tried:
+                    raise error
+                raise
+            try:
+                return backend, backend.client.post(dict(data, model=backend.model), stream=stream)
+            except LLMTimeout:
+                self.finish(backend)
+                raise
+            except LLMServiceUnavailable as e:
+                error = e
+                tried.append(backend)
+                self.finish(backend)
+            except Exception:
+                self.finish(backend)
+                raise
+    
+    def complete(self, data, task):
+        """Returns (backend, completion)"""
+        backend, response = self.post(data, task)
+        try:
+            return backend, response.json()
+        finally:
+            self.finish(backend)
+    
+    def complete_json(self, data, task):
+        """Stream a completion and hang up as soon as its JSON object closes.
+        
+        Dropping the connection stops the server generating, so a model that keeps talking after
+        the object costs nothing. Returns (backend, completion) like complete().
+        """
+        backend, response = self.post(dict(data, stream=True), task, stream=True)
+        try:
+            content = read_json_object(iter_stream_deltas(response))
+        finally:
+            response.close()
+            self.finish(backend)
+        return backend, self.make_completion(backend, content)
+    
+    @staticmethod
+    def make_completion(backend, content):
+        return {'model': backend.model, 'choices': [{'message': {'role': 'assistant', 'content': content}}]}
+    
+    async def complete_async(self, data, task, json_object=False):
+        """Returns (backend, completion); with json_object the reply is read like complete_json()"""
+        tried = []
+        while True:
+            try:
+                backend = self.choose(task, tried)
+            except LLMServiceUnavailable:
+                if tried:
+                    raise error
+                raise
+            try:
+                if json_object:
+                    content = await backend.async_client.post(dict(data, model=backend.model, stream=True), json_object=True)
+                    return backend, self.make_completion(backend, content)
+                return backend, await backend.async_client.post(dict(data, model=backend.model))
+            except LLMTimeout:
+                raise
+            except LLMServiceUnavailable as e:
+                error = e
+                tried.append(backend)
+            finally:
+                self.finish(backend)
+    
+    async def open(self):
+        for backend in self.backends:
+            await backend.async_client.open()
+    
+    async def close(self):
+        for backend in self.backends:
+            await backend.async_client.close()
+    
+    def start(self):
+        """Check every backend's /models endpoint in the background every health_interval seconds"""
+        if self.thread or self.health_interval <= 0:
+            return
+        self.thread = threading.Thread(target=self.run_health_checks, name='llm-health', daemon=True)
+        self.thread.start()
+    
+    def run_health_checks(self):
+        while True:
+            for backend in self.backends:
+                backend.check_health()
+            time.sleep(self.health_interval)
+    
+    def get_stats(self):
+        with self.lock:
+            return [backend.get_stats() for backend in self.backends]
+
+llm_router = LLMRouter([LLMBackend(**backend) for backend in LLM_BACKENDS], LLM_HEALTH_INTERVAL)
+
+# LLM completion cache configuration
+LLM_CACHE_PATH = os.environ.get('LLM_CACHE_PATH', 'llm_cache.db')
+LLM_CACHE_TTL = float(os.environ.get('LLM_CACHE_TTL', 7 * 24 * 3600))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 5000))
+
+class CompletionCache:
+    """SQLite-backed completion cache keyed on a hash of the request, with TTL and LRU eviction"""
+    
+    def __init__(self, path, ttl, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'bypassed': 0, 'evictions': 0}
+        
+        conn = self.connect()
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS completion_cache (
+            key TEXT PRIMARY KEY,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_completion_cache_last_used ON completion_cache (last_used)')
+        conn.commit()
+        conn.close()
+    
+    def connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+    
+    @staticmethod
+    def make_key(data):
+        """Hash the parts of a request that determine its answer (model, prompt, temperature)"""
+        material = {
+            'model': data.get('model'),
+            'messages': data.get('messages'),
+            'temperature': data.get('temperature'),
+            'max_tokens': data.get('max_tokens')
+        }
+        return hashlib.sha256(json.dumps(material, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def count(self, stat, amount=1):
+        with self.lock:
+            self.stats[stat] += amount
+    
+    def get(self, key):
+        now = time.time()
+        conn = self.connect()
+        row = conn.execute('SELECT response, created_at FROM completion_cache WHERE key = ?', (key,)).fetchone()
+        
+        if row and now - row[1] < self.ttl:
+            conn.execute('UPDATE completion_cache SET last_used = ? WHERE key = ?', (now, key))
+            conn.commit()
+            conn.close()
+            self.count('hits')
+            return json.loads(row[0])
+        
+        if row:
+            # Expired entry
+            conn.execute('DELETE FROM completion_cache WHERE key = ?', (key,))
+            conn.commit()
+        conn.close()
+        self.count('misses')
+        return None
+    
+    def set(self, key, completion):
+        now = time.time()
+        conn = self.connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO completion_cache (key, response, created_at, last_used) VALUES (?, ?, ?, ?)',
+            (key, json.dumps(completion), now, now)
+        )
+        # Evict least recently used entries beyond the size bound
+        cursor = conn.execute(
+            'DELETE FROM completion_cache WHERE key IN '
+            '(SELECT key FROM completion_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,)
+        )
+        conn.commit()
+        conn.close()
+        if cursor.rowcount > 0:
+            self.count('evictions', cursor.rowcount)
+    
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+        conn = self.connect()
+        stats['entries'] = conn.execute('SELECT COUNT(*) FROM completion_cache').fetchone()[0]
+        conn.close()
+        return stats
+
+completion_cache = CompletionCache(LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_ENTRIES)
+
+class SingleFlight:
+    """Let concurrent callers with the same request key share one upstream call and its result.
+    
+    Works across threads and event loops: each in-flight call is a concurrent.futures.Future that
+    blocking callers wait on directly and async callers await through asyncio.wrap_future.
+    
+    Only results and shared_errors (minus private_errors) are handed to the callers waiting on a
+    call. Any other failure belongs to the caller that made it, such as a per-user rejection or a
+    cancelled request, so the waiting callers start the call again themselves.
+    """
+    
+    # Resolves a call whose failure the waiting callers shouldn't see
+    RETRY = object()
+    
+    def __init__(self, shared_errors=(), private_errors=()):
+        self.shared_errors = shared_errors
+        self.private_errors = private_errors
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.stats = {'upstream': 0, 'coalesced': 0}
+    
+    def join(self, key):
+        """Return (future, leader); the leader must make the call and resolve the future"""
+        with self.lock:
+            future = self.calls.get(key)
+            if future is not None:
+                self.stats['coalesced'] += 1
+                return future, False
+            future = self.calls[key] = Future()
+            self.stats['upstream'] += 1
+            return future, True
+    
+    def finish(self, key, future, result=None, error=None):
+        with self.lock:
+            del self.calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    
+    def fail(self, key, future, error):
+        if isinstance(error, self.shared_errors) and not isinstance(error, self.private_errors):
+            self.finish(key, future, error=error)
+        else:
+            self.finish(key, future, self.RETRY)
+    
+    def do(self, key, fn):
+        while True:
+            future, leader = self.join(key)
+            if leader:
+                break
+            result = future.result()
+            if result is not self.RETRY:
+                return result
+        try:
+            result = fn()
+        except BaseException as e:
+            self.fail(key, future, e)
+            raise
+        self.finish(key, future, result)
+        return result
+    
+    async def do_async(self, key, fn):
+        while True:
+            future, leader = self.join(key)
+            if leader:
+                break
+            result = await asyncio.wrap_future(future)
+            if result is not self.RETRY:
+                return result
+        try:
+            result = await fn()
+        except BaseException as e:
+            self.fail(key, future, e)
+            raise
+        self.finish(key, future, result)
+        return result
+    
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats, in_flight=len(self.calls))
+        calls = stats['upstream'] + stats['coalesced']
+        stats['coalesced_rate'] = round(stats['coalesced'] / calls, 3) if calls else 0.0
+        return stats
+
+# Identical prompts already on their way to LM Studio; a model server outage is the same for
+# everyone, but a scheduler rejection is about the caller's own queue
+llm_flights = SingleFlight(shared_errors=(LLMServiceUnavailable,), private_errors=(LLMQueueFull,))
+
+# LLM admission control
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 2 * len(LLM_BACKENDS)))
+LLM_QUEUE_DEPTH = int(os.environ.get('LLM_QUEUE_DEPTH', 50))
+LLM_USER_QUEUE_DEPTH = int(os.environ.get('LLM_USER_QUEUE_DEPTH', 5))
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', 60))
+# Priority classes, most urgent first, and the class each kind of model request runs in
+LLM_PRIORITIES = ('interactive', 'analysis', 'batch')
+LLM_TASKS = {'chat': 'interactive', 'summary': 'analysis', 'scoring': 'batch'}
+# Generation caps per task; -1 leaves the length to the model
+LLM_TASK_MAX_TOKENS = {
+    'summary': int(os.environ.get('LLM_SUMMARY_MAX_TOKENS', 400)),
+    'scoring': int(os.environ.get('LLM_SCORING_MAX_TOKENS', 96)),
+}
+
+class LLMTicket:
+    """A caller's place in the LLM scheduler; resolved once it may call the model"""
+    
+    def __init__(self, scheduler, priority, user_id):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.user_id = user_id
+        self.future = Future()
+        self.state = 'queued'
+        self.started = None
+    
+    def wait(self, timeout=LLM_QUEUE_TIMEOUT):
+        try:
+            self.future.result(timeout)
+        except FutureTimeoutError:
+            self.scheduler.give_up(self)
+    
+    async def wait_async(self, timeout=LLM_QUEUE_TIMEOUT):
+        try:
+            # Shielded so a timeout or cancelled request never cancels the shared future
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(self.future)), timeout)
+        except asyncio.TimeoutError:
+            self.scheduler.give_up(self)
+    
+    def release(self):
+        self.scheduler.release(self)
+
+class LLMScheduler:
+    """Admission control in front of LM Studio.
+    
+    At most max_concurrency generations run at once. Everyone else waits in a bounded queue, served
+    by priority class and round-robin across users within a class, so one user's backlog cannot
+    starve the others. Callers are turned away with LLMQueueFull when the queue or their share of it
+    is full.
+    """
+    
+    def __init__(self, max_concurrency, max_queue, max_user_queue):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_user_queue = max_user_queue
+        self.lock = threading.Lock()
+        self.running = 0
+        # One ordered mapping of user -> waiting tickets per priority class; order is the rotation
+        self.waiting = {priority: OrderedDict() for priority in LLM_PRIORITIES}
+        self.queued = 0
+        self.queued_by_user = Counter()
+        # Moving average of generation time, for Retry-After
+        self.service_time = 10.0
+        self.stats = {'admitted': 0, 'waited': 0, 'rejected_full': 0, 'rejected_user': 0, 'timed_out': 0}
+    
+    def acquire(self, priority='analysis', user_id=None):
+        """Take a slot or a place in the queue, raising LLMQueueFull when there is no room"""
+        if priority not in self.waiting:
+            raise ValueError(f"Unknown LLM priority: {priority}")
+        ticket = LLMTicket(self, priority, user_id)
+        
+        with self.lock:
+            if self.running < self.max_concurrency:
+                self.start(ticket)
+                self.stats['admitted'] += 1
+                return ticket
+            if self.queued >= self.max_queue:
+                self.stats['rejected_full'] += 1
+                raise LLMQueueFull("The assistant is busy, please try again shortly", 503, self.retry_after())
+            if user_id is not None and self.queued_by_user[user_id] >= self.max_user_queue:
+                self.stats['rejected_user'] += 1
+                raise LLMQueueFull("You have too many requests waiting for the assistant", 429, self.retry_after())
+            
+            self.waiting[priority].setdefault(user_id, deque()).append(ticket)
+            self.queued += 1
+            self.queued_by_user[user_id] += 1
+            self.stats['waited'] += 1
+        return ticket
+    
+    def start(self, ticket):
+        self.running += 1
+        ticket.state = 'running'
+        ticket.started = time.monotonic()
+        ticket.future.set_result(None)
+    
+    def dequeue(self, ticket):
+        users = self.waiting[ticket.priority]
+        tickets = users[ticket.user_id]
+        tickets.remove(ticket)
+        if not tickets:
+            del users[ticket.user_id]
+        self.queued -= 1
+        self.queued_by_user[ticket.user_id] -= 1
+        if not self.queued_by_user[ticket.user_id]:
+            del self.queued_by_user[ticket.user_id]
+    
+    def grant(self):
+        """Hand free slots to the next users in line; the caller holds the lock"""
+        while self.running < self.max_concurrency and self.queued:
+            users = next(users for users in self.waiting.values() if users)
+            user_id, tickets = next(iter(users.items()))
+            ticket = tickets[0]
+            self.dequeue(ticket)
+            # Round robin: a user with more waiting goes to the back of their class
+            if user_id in users:
+                users.move_to_end(user_id)
+            self.start(ticket)
+    
+    def release(self, ticket):
+        """Free a finished caller's slot, or its place in the queue, exactly once"""
+        with self.lock:
+            if ticket.state == 'queued':
+                self.dequeue(ticket)
+            elif ticket.state == 'running':
+                self.running -= 1
+                self.service_time = 0.8 * self.service_time + 0.2 * (time.monotonic() - ticket.started)
+            ticket.state = 'done'
+            self.grant()
+    
+    def give_up(self, ticket):
+        """Leave the queue after a wait timed out, unless a slot was granted in the meantime"""
+        with self.lock:
+            if ticket.state == 'running':
+                return
+            self.dequeue(ticket)
+            ticket.state = 'done'
+            self.stats['timed_out'] += 1
+            retry_after = self.retry_after()
+        raise LLMQueueFull("Timed out waiting for the assistant, please try again shortly", 503, retry_after)
+    
+    def retry_after(self):
+        """Seconds until the current backlog should have drained"""
+        return max(1, math.ceil(self.service_time * (self.queued + self.running) / self.max_concurrency))
+    
+    @contextmanager
+    def slot(self, priority='analysis', user_id=None):
+        ticket = self.acquire(priority, user_id)
+        try:
+            ticket.wait()
+            yield
+        finally:
+            ticket.release()
+    
+    @asynccontextmanager
+    async def slot_async(self, priority='analysis', user_id=None):
+        ticket = self.acquire(priority, user_id)
+        try:
+            await ticket.wait_async()
+            yield
+        finally:
+            ticket.release()
+    
+    def get_stats(self):
+        with self.lock:
+            return dict(
+                self.stats,
+                running=self.running,
+                queued=self.queued,
+                queued_by_priority={priority: sum(map(len, users.values())) for priority, users in self.waiting.items()},
+                service_time=round(self.service_time, 2)
+            )
+
+llm_scheduler = LLMScheduler(LLM_MAX_CONCURRENCY, LLM_QUEUE_DEPTH, LLM_USER_QUEUE_DEPTH)
 
 # Database setup
-def get_db_connection():
-    conn = sqlite3.connect('resume_builder.db')
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'resume_builder.db')
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024))
+DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', 64 * 1024))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 16))
+
+def get_db_connection(path=None, check_same_thread=True):
+    """Open a new tuned connection; request handlers should use get_db() instead"""
+    conn = sqlite3.connect(path or DATABASE_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
+    # WAL lets dashboard readers proceed while edits and chats write
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA mmap_size = {DB_MMAP_SIZE}')
+    conn.execute(f'PRAGMA cache_size = -{DB_CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store = MEMORY')
     return conn
 
-def init_db():
-    conn = get_db_connection()
+class ConnectionPool:
+    """Keeps idle connections around so request threads reuse them instead of reconnecting"""
+    
+    def __init__(self, path, max_idle):
+        self.path = path
+        self.idle = queue.LifoQueue(maxsize=max_idle)
+    
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            # Connections move between worker threads, but only one uses a connection at a time
+            return get_db_connection(self.path, check_same_thread=False)
+    
+    def release(self, conn):
+        try:
+            # Never hand a half-finished transaction to the next request
+            if conn.in_transaction:
+                conn.rollback()
+            self.idle.put_nowait(conn)
+        except (queue.Full, sqlite3.Error):
+            conn.close()
+
+db_pool = ConnectionPool(DATABASE_PATH, DB_POOL_SIZE)
+
+def get_db():
+    """Return this app context's pooled connection, checking one out on first use"""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+def migrate_conversation_blobs(cursor):
+    """Copy each conversation's JSON message blob into one messages row per message"""
+    cursor.execute("SELECT id, messages, created_at FROM conversations WHERE messages != '[]'")
+    for conversation_id, blob, created_at in cursor.fetchall():
+        try:
+            messages = json.loads(blob)
+        except ValueError:
+            continue
+        cursor.executemany(
+            'INSERT INTO messages (conversation_id, seq, role, content, created_at) VALUES (?, ?, ?, ?, ?)',
+            [(conversation_id, seq, message.get('role', 'user'), message.get('content', ''), created_at)
+             for seq, message in enumerate(messages, start=1)]
+        )
+    cursor.execute("UPDATE conversations SET messages = '[]'")
+
+def migrate_match_index(cursor):
+    """Record the term set of every stored resume and job description"""
+    build_match_index(cursor.connection)
+
+# Gap between neighbouring section positions, leaving room to reorder without renumbering
+SECTION_POSITION_GAP = 1024
+
+# Schema migrations, applied in order at startup. Append new steps to the end;
+# never edit or reorder a step that has already shipped. A step is either SQL
+# or a callable that receives the migration cursor.
+MIGRATIONS = [
+    (1, 'Index resumes by owner and last update for the dashboard', [
+        'CREATE INDEX IF NOT EXISTS idx_resumes_user_updated ON resumes (user_id, updated_at)'
+    ]),
+    (2, 'Index resume sections by resume', [
+        'CREATE INDEX IF NOT EXISTS idx_resume_sections_resume ON resume_sections (resume_id)'
+    ]),
+    (3, 'Index conversations by resume, owner and creation time', [
+        'CREATE INDEX IF NOT EXISTS idx_conversations_resume_user_created ON conversations (resume_id, user_id, created_at)'
+    ]),
+    (4, 'Index jobs by resume for the dashboard pending badge', [
+        'CREATE INDEX IF NOT EXISTS idx_jobs_resume_status ON jobs (resume_id, status)'
+    ]),
+    (5, 'Store chat messages one row per message', [
+        '''
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER NOT NULL,
+            seq INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_conversation_seq ON messages (conversation_id, seq)',
+        migrate_conversation_blobs
+    ]),
+    (6, 'Cache running summaries of older chat turns', [
+        '''
+        CREATE TABLE IF NOT EXISTS conversation_summaries (
+            conversation_id INTEGER PRIMARY KEY,
+            through_seq INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
+        )
+        '''
+    ]),
+    (7, 'Track a revision number on resumes for export caching', [
+        'ALTER TABLE resumes ADD COLUMN revision INTEGER NOT NULL DEFAULT 1'
+    ]),
+    (8, 'Give resume sections an explicit position', [
+        'ALTER TABLE resume_sections ADD COLUMN position INTEGER NOT NULL DEFAULT 0',
+        # Ids already follow insertion order, so spacing them out keeps the current order
+        f'UPDATE resume_sections SET position = id * {SECTION_POSITION_GAP}',
+        'CREATE INDEX IF NOT EXISTS idx_resume_sections_resume_position ON resume_sections (resume_id, position)',
+        'DROP INDEX IF EXISTS idx_resume_sections_resume'
+    ]),
+    (9, 'Cache text metrics per resume section', [
+        '''
+        CREATE TABLE IF NOT EXISTS section_metrics (
+            section_id INTEGER PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            phrases TEXT NOT NULL,
+            word_count INTEGER NOT NULL,
+            action_verb_count INTEGER NOT NULL,
+            past_tense_count INTEGER NOT NULL,
+            present_tense_count INTEGER NOT NULL,
+            bullet_count INTEGER NOT NULL,
+            digit_count INTEGER NOT NULL,
+            FOREIGN KEY (section_id) REFERENCES resume_sections (id) ON DELETE CASCADE
+        )
+        '''
+    ]),
+    (10, 'Full-text index over resume titles, target jobs and sections', [
+        # One row per section (rowid = section id) carrying its resume's title and target job;
+        # user_id is indexed so searches can be scoped to an owner inside the index
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS resume_search USING fts5(
+            title, target_job, section_name, content, user_id, resume_id UNINDEXED,
+            tokenize = 'porter unicode61 remove_diacritics 2'
+        )
+        ''',
+        # Rank by bm25 weighted towards title, then target job, section name and content
+        "INSERT INTO resume_search (resume_search, rank) VALUES ('rank', 'bm25(5.0, 3.0, 2.0, 1.0, 0.0)')",
+        '''
+        INSERT INTO resume_search (rowid, title, target_job, section_name, content, user_id, resume_id)
+        SELECT resume_sections.id, resumes.title, COALESCE(resumes.target_job, ''), resume_sections.section_name,
+               resume_sections.content, resumes.user_id, resumes.id
+        FROM resume_sections JOIN resumes ON resumes.id = resume_sections.resume_id
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS resume_sections_search_insert AFTER INSERT ON resume_sections BEGIN
+            INSERT INTO resume_search (rowid, title, target_job, section_name, content, user_id, resume_id)
+            SELECT new.id, title, COALESCE(target_job, ''), new.section_name, new.content, user_id, id
+            FROM resumes WHERE id = new.resume_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS resume_sections_search_update AFTER UPDATE OF section_name, content ON resume_sections
+        WHEN old.section_name IS NOT new.section_name OR old.content IS NOT new.content BEGIN
+            UPDATE resume_search SET section_name = new.section_name, content = new.content WHERE rowid = new.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS resume_sections_search_delete AFTER DELETE ON resume_sections BEGIN
+            DELETE FROM resume_search WHERE rowid = old.id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS resumes_search_update AFTER UPDATE OF title, target_job ON resumes
+        WHEN old.title IS NOT new.title OR old.target_job IS NOT new.target_job BEGIN
+            UPDATE resume_search SET title = new.title, target_job = COALESCE(new.target_job, '')
+            WHERE rowid IN (SELECT id FROM resume_sections WHERE resume_id = new.id);
+        END
+        '''
+    ]),
+    (11, 'Keep submitted job descriptions for keyword weighting', [
+        '''
+        CREATE TABLE IF NOT EXISTS job_descriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            content TEXT NOT NULL,
+            content_hash TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        '''
+    ]),
+    (12, 'Keep job matching document frequencies up to date as documents change', [
+        # document is 'resume:<id>' or 'job:<id>'; terms is its sorted JSON term list
+        '''
+        CREATE TABLE IF NOT EXISTS match_terms (
+            document TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            terms TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS match_doc_freq (
+            term TEXT PRIMARY KEY,
+            doc_count INTEGER NOT NULL
+        )
+        ''',
+        migrate_match_index
+    ]),
+    (13, 'Lease running jobs to the worker process that claimed them', [
+        'ALTER TABLE jobs ADD COLUMN worker_id TEXT',
+        'ALTER TABLE jobs ADD COLUMN heartbeat_at TIMESTAMP'
+    ]),
+]
+
+def run_migrations(conn):
+    """Apply any migrations newer than the recorded schema version"""
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    current_version = cursor.fetchone()[0]
+    conn.commit()
+    
+    for version, description, statements in MIGRATIONS:
+        if version <= current_version:
+            continue
+        try:
+            # Explicit transaction so DDL and the version bump commit together
+            cursor.execute('BEGIN')
+            for statement in statements:
+                if callable(statement):
+                    statement(cursor)
+                else:
+                    cursor.execute(statement)
+            cursor.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)', (version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    return max([current_version] + [version for version, _, _ in MIGRATIONS])
+
+def init_db(path=None, migrate=True):
+    conn = get_db_connection(path)
     cursor = conn.cursor()
     
     # Users table
@@ -122,14 +1123,290 @@ def init_db():
     )
     ''')
     
+    # Background jobs table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_type TEXT NOT NULL,
+        resume_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (resume_id) REFERENCES resumes (id) ON DELETE CASCADE
+    )
+    ''')
+    
+    # At most one pending job per (job_type, resume) so repeated saves coalesce
+    cursor.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_pending
+    ON jobs (job_type, resume_id) WHERE status = 'pending'
+    ''')
+    
     conn.commit()
+    
+    if migrate:
+        run_migrations(conn)
+    
     conn.close()
 
-# Initialize database on startup
-init_db()
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+async def run_in_db(fn, *args):
+    """Call fn(conn, *args) with this request's connection on a worker thread, then commit.
+    
+    Async views use this for all database work: a write can wait busy_timeout on another writer,
+    and on the event loop that wait would stall every request in flight.
+    """
+    def call():
+        conn = get_db()
+        result = fn(conn, *args)
+        conn.commit()
+        return result
+    return await asyncio.to_thread(call)
+
+# Background job queue configuration
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 2))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+# A running job whose worker has not renewed its lease for this long is assumed dead and requeued
+JOB_LEASE_TIMEOUT = float(os.environ.get('JOB_LEASE_TIMEOUT', 60))
+
+class JobQueue:
+    """Local job queue backed by the jobs table and drained by a pool of worker threads.
+    
+    Every server process runs its own workers. A claimed job is leased to the claiming process,
+    which renews the lease while the job runs; only jobs whose lease has lapsed are requeued,
+    so one process never takes over another live process's work.
+    """
+    
+    def __init__(self, workers, poll_interval, max_attempts, lease_timeout):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease_timeout = lease_timeout
+        self.handlers = {}
+        self.threads = []
+        self.worker_id = None
+        self.active = set()
+        self.active_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+    
+    def register(self, job_type, handler):
+        self.handlers[job_type] = handler
+    
+    def enqueue(self, job_type, resume_id, conn=None):
+        """Queue a job, coalescing with any job of the same type still pending for the resume"""
+        own_conn = conn is None
+        if own_conn:
+            conn = get_db_connection()
+        
+        conn.execute(
+            '''INSERT INTO jobs (job_type, resume_id) VALUES (?, ?)
+            ON CONFLICT (job_type, resume_id) WHERE status = 'pending'
+            DO UPDATE SET updated_at = CURRENT_TIMESTAMP''',
+            (job_type, resume_id)
+        )
+        
+        if own_conn:
+            conn.commit()
+            conn.close()
+            self.notify()
+    
+    def notify(self):
+        """Wake idle workers; call after committing a transaction that enqueued jobs"""
+        self.wakeup.set()
+    
+    def recover(self):
+        """Requeue running jobs whose worker stopped renewing their lease, e.g. because its process died"""
+        conn = get_db_connection()
+        try:
+            stale = f"status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < datetime('now', '-{self.lease_timeout:g} seconds'))"
+            # A newer pending job for the same resume supersedes the interrupted one
+            conn.execute(f'''
+            DELETE FROM jobs WHERE {stale} AND EXISTS (
+                SELECT 1 FROM jobs AS pending
+                WHERE pending.status = 'pending'
+                AND pending.job_type = jobs.job_type AND pending.resume_id = jobs.resume_id
+            )
+            ''')
+            cursor = conn.execute(f"UPDATE jobs SET status = 'pending', worker_id = NULL, heartbeat_at = NULL WHERE {stale}")
+            if cursor.rowcount:
+                app.logger.warning("Requeued %d jobs abandoned by a stopped worker", cursor.rowcount)
+            conn.execute("DELETE FROM jobs WHERE status = 'done' AND updated_at < datetime('now', '-1 day')")
+            conn.commit()
+        finally:
+            conn.close()
+        if cursor.rowcount:
+            self.notify()
+    
+    def renew_leases(self):
+        """Extend the lease on every job this process is running"""
+        with self.active_lock:
+            job_ids = list(self.active)
+        if not job_ids:
+            return
+        conn = get_db_connection()
+        try:
+            conn.execute(
+                f"UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP WHERE worker_id = ? AND status = 'running' "
+                f"AND id IN ({','.join('?' * len(job_ids))})",
+                [self.worker_id] + job_ids
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def claim(self):
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM jobs WHERE status = 'pending' ORDER BY id LIMIT 1")
+            job = cursor.fetchone()
+            
+            if job:
+                cursor.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker_id = ?, "
+                    "heartbeat_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP "
+                    "WHERE id = ? AND status = 'pending'",
+                    (self.worker_id, job['id'])
+                )
+                conn.commit()
+                if cursor.rowcount == 0:
+                    # Another worker claimed it first
+                    job = None
+        finally:
+            conn.close()
+        return job
+    
+    def finish(self, job, error=None):
+        # Only while this process still holds the lease; a lapsed job may already be running elsewhere
+        owned = "id = ? AND worker_id = ? AND status = 'running'"
+        conn = get_db_connection()
+        try:
+            try:
+                if error is None:
+                    conn.execute(f"UPDATE jobs SET status = 'done', error = NULL, updated_at = CURRENT_TIMESTAMP WHERE {owned}",
+                                 (job['id'], self.worker_id))
+                elif job['attempts'] + 1 < self.max_attempts:
+                    conn.execute(f"UPDATE jobs SET status = 'pending', worker_id = NULL, error = ?, updated_at = CURRENT_TIMESTAMP WHERE {owned}",
+                                 (error, job['id'], self.worker_id))
+                else:
+                    conn.execute(f"UPDATE jobs SET status = 'failed', error = ?, updated_at = CURRENT_TIMESTAMP WHERE {owned}",
+                                 (error, job['id'], self.worker_id))
+                conn.commit()
+            except sqlite3.IntegrityError:
+                # A newer job for this resume was queued while this one ran; let it take over
+                conn.rollback()
+                conn.execute(f"UPDATE jobs SET status = 'failed', error = ?, updated_at = CURRENT_TIMESTAMP WHERE {owned}",
+                             (error, job['id'], self.worker_id))
+                conn.commit()
+        finally:
+            conn.close()
+    
+    def run_one(self):
+        """Claim and run a single job, returning False when the queue is empty"""
+        job = self.claim()
+        if job is None:
+            return False
+        
+        with self.active_lock:
+            self.active.add(job['id'])
+        try:
+            try:
+                self.handlers[job['job_type']](job)
+            except Exception as e:
+                self.finish(job, error=str(e))
+            else:
+                self.finish(job)
+        finally:
+            # If finish failed the lease now lapses, and recovery requeues the job
+            with self.active_lock:
+                self.active.discard(job['id'])
+        return True
+    
+    def work(self):
+        while not self.stopping.is_set():
+            try:
+                if self.run_one():
+                    continue
+            except sqlite3.Error as e:
+                app.logger.warning("Job queue database error, retrying in %gs: %s", self.poll_interval, e)
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+    
+    def maintain(self):
+        """Renew this process's leases and requeue lapsed ones, several times per lease period"""
+        while not self.stopping.wait(self.lease_timeout / 3):
+            try:
+                self.renew_leases()
+                self.recover()
+            except sqlite3.Error as e:
+                app.logger.warning("Job lease upkeep failed: %s", e)
+    
+    def start(self):
+        if self.threads or self.workers <= 0:
+            return
+        # Set here rather than at import so a forked server worker gets its own id
+        self.worker_id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        thread = threading.Thread(target=self.maintain, name='job-leases', daemon=True)
+        thread.start()
+        self.threads.append(thread)
+    
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+
+job_queue = JobQueue(JOB_WORKERS, JOB_POLL_INTERVAL, JOB_MAX_ATTEMPTS, JOB_LEASE_TIMEOUT)
+
+def run_score_job(job):
+    """Score the stored resume content and save the result"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT content, target_job FROM resumes WHERE id = ?', (job['resume_id'],))
+        resume = cursor.fetchone()
+        
+        if resume:
+            # Only sections edited since their metrics were stored get re-analyzed
+            metrics = get_sectioned_resume_metrics(conn, job['resume_id'])
+            score_result = score_resume(metrics, resume['target_job'])
+            
+            # Ensure `score_result` is a dictionary
+            if isinstance(score_result, int):
+                score_result = {"score": score_result}
+            
+            cursor.execute('UPDATE resumes SET score = ? WHERE id = ?', (score_result['score'], job['resume_id']))
+            # Content changes reach the matching corpus here, off the request path
+            index_match_document(conn, f"resume:{job['resume_id']}", resume['content'])
+            conn.commit()
+    finally:
+        conn.close()
+
+job_queue.register('score_resume', run_score_job)
 
 # Authentication decorator
 def login_required(f):
+    if inspect.iscoroutinefunction(f):
+        # Stay a coroutine function so async views are still recognised as async
+        @wraps(f)
+        async def decorated_coroutine(*args, **kwargs):
+            if 'user_id' not in session:
+                return redirect(url_for('login', next=request.url))
+            return await f(*args, **kwargs)
+        return decorated_coroutine
+    
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
@@ -138,11 +1415,8 @@ def login_required(f):
     return decorated_function
 
 # Create chat completion using LM Studio API
-def create_chat_completion(user_input, context=""):
-    """
-    Creates a chat completion using the LM Studio API
-    With optional context for more personalized responses
-    """
+def build_resume_prompt(user_input, context=""):
+    """Wrap the user's input in the resume assistant instructions"""
     # For resume-specific guidance with additional context
     resume_instructions = f"""
     You are a helpful resume-building assistant. Help the user create or improve their resume
@@ -155,131 +1429,314 @@ def create_chat_completion(user_input, context=""):
     User query: 
     """
     
-    enhanced_input = resume_instructions + user_input
+    return resume_instructions + user_input
+
+def build_chat_request(user_input, context="", stream=False, history=None, task='chat', schema=None):
+    """Build the LM Studio request body for a resume assistant prompt, after any prior turns.
     
-    headers = {
-        "Content-Type": "application/json"
-    }
+    With a JSON schema the model is constrained to a single matching object, sampled greedily so
+    the same prompt gets the same answer.
+    """
+    content = build_resume_prompt(user_input, context)
+    if schema:
+        # Servers without grammar support only have the instruction to go on
+        content += f"\n\nReply with only a JSON object matching this JSON schema:\n{json.dumps(schema)}"
     data = {
-        "model": "mistral-7b-instruct-v0.3:2",
-        "messages": [
-            {"role": "user", "content": enhanced_input}
-        ],
-        "temperature": 0.7,
-        "max_tokens": -1,
-        "stream": False
+        "model": llm_router.model_for(task),
+        "messages": list(history or []) + [{"role": "user", "content": content}],
+        "temperature": 0 if schema else 0.7,
+        "max_tokens": LLM_TASK_MAX_TOKENS.get(task, -1),
+        "stream": stream
     }
-    
-    response = requests.post(LM_STUDIO_API_URL, headers=headers, data=json.dumps(data))
+    if schema:
+        data["response_format"] = {"type": "json_schema", "json_schema": {"name": task, "strict": True, "schema": schema}}
+    return data
 
-    if response.status_code == 200:
-        return response.json()
-    else:
-        raise Exception(f"Error {response.status_code}: {response.text}")
+STREAM_END = object()
 
-# ATS Keyword Optimization
-def optimize_for_ats(resume_text, job_description):
-    """Analyze and optimize a resume for ATS compatibility based on job description"""
-    prompt = f"""
-    Analyze this resume for ATS (Applicant Tracking System) compatibility based on the job description.
-    Identify missing keywords and suggest improvements.
-    
-    Job Description:
-    {job_description}
-    
-    Resume:
-    {resume_text}
-    
-    Please provide:
-    1. A list of important keywords from the job description that are missing in the resume
-    2. Specific suggestions for incorporating these keywords naturally
-    3. Overall ATS optimization score out of 100
-    """
-    
+def parse_stream_line(line):
+    """The content fragment in one SSE line: None if it has none, STREAM_END for the closing "data: [DONE]" line"""
+    if not line or not line.startswith('data:'):
+        return None
+    payload = line[len('data:'):].strip()
+    if payload == '[DONE]':
+        return STREAM_END
+    chunk = json.loads(payload)
+    choices = chunk.get('choices') or [{}]
+    return choices[0].get('delta', {}).get('content')
+
+def iter_stream_deltas(response):
+    """Content fragments of an OpenAI-style SSE stream"""
+    for line in response.iter_lines(decode_unicode=True):
+        delta = parse_stream_line(line)
+        if delta is STREAM_END:
+            break
+        if delta:
+            yield delta
+
+async def iter_stream_deltas_async(content):
+    """iter_stream_deltas for an aiohttp response body"""
+    async for line in content:
+        delta = parse_stream_line(line.decode('utf-8').strip())
+        if delta is STREAM_END:
+            break
+        if delta:
+            yield delta
+
+class JSONObjectReader:
+    """Collects streamed fragments up to the end of the first top-level JSON object, dropping anything before it"""
+    
+    def __init__(self):
+        self.parts = []
+        self.depth = 0
+        self.in_string = self.escaped = False
+    
+    def feed(self, delta):
+        """Take the next fragment, returning True once the object has closed"""
+        start = 0
+        for index, char in enumerate(delta):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '{':
+                if not self.depth:
+                    start = index
+                self.depth += 1
+            elif not self.depth:
+                continue
+            elif char == '"':
+                self.in_string = True
+            elif char == '}':
+                self.depth -= 1
+                if not self.depth:
+                    self.parts.append(delta[start:index + 1])
+                    return True
+        if self.depth:
+            self.parts.append(delta[start:])
+        return False
+    
+    @property
+    def text(self):
+        # If the stream ended first, e.g. at max_tokens, the caller's parse will reject this
+        return ''.join(self.parts)
+
+def read_json_object(deltas):
+    """Join streamed fragments up to the end of the first top-level JSON object"""
+    reader = JSONObjectReader()
+    for delta in deltas:
+        if reader.feed(delta):
+            break
+    return reader.text
+
+async def read_json_object_async(deltas):
+    """read_json_object for an async stream of fragments"""
+    reader = JSONObjectReader()
+    async for delta in deltas:
+        if reader.feed(delta):
+            break
+    return reader.text
+
+JSON_SCHEMA_TYPES = {
+    'object': dict, 'array': list, 'string': str, 'boolean': bool,
+    'integer': int, 'number': (int, float), 'null': type(None)
+}
+
+def validate_json(value, schema, path='$'):
+    """Check a value against the subset of JSON Schema used for structured replies, raising ValueError"""
+    expected = schema.get('type')
+    if expected:
+        # bool is an int subclass, but not a JSON number
+        if not isinstance(value, JSON_SCHEMA_TYPES[expected]) or (isinstance(value, bool) and expected != 'boolean'):
+            raise ValueError(f"{path} should be of type {expected}")
+    if 'enum' in schema and value not in schema['enum']:
+        raise ValueError(f"{path} should be one of {schema['enum']}")
+    if 'minimum' in schema and value < schema['minimum']:
+        raise ValueError(f"{path} should be at least {schema['minimum']}")
+    if 'maximum' in schema and value > schema['maximum']:
+        raise ValueError(f"{path} should be at most {schema['maximum']}")
+    if 'maxLength' in schema and len(value) > schema['maxLength']:
+        raise ValueError(f"{path} should be at most {schema['maxLength']} characters")
+    
+    if isinstance(value, dict):
+        properties = schema.get('properties', {})
+        for name in schema.get('required', ()):
+            if name not in value:
+                raise ValueError(f"{path}.{name} is missing")
+        for name, item in value.items():
+            if name in properties:
+                validate_json(item, properties[name], f"{path}.{name}")
+            elif schema.get('additionalProperties') is False:
+                raise ValueError(f"{path}.{name} is not allowed")
+    elif isinstance(value, list) and 'items' in schema:
+        for index, item in enumerate(value):
+            validate_json(item, schema['items'], f"{path}[{index}]")
+
+def parse_structured_reply(completion, schema):
+    """The JSON object in a structured completion, raising ValueError unless it fits the schema"""
     try:
-        completion = create_chat_completion(prompt)
-        return completion['choices'][0]['message']['content']
-    except Exception as e:
-        return f"Error in ATS analysis: {str(e)}"
+        value = json.loads(completion['choices'][0]['message']['content'])
+    except (KeyError, IndexError, TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Reply is not a JSON object: {e}")
+    validate_json(value, schema)
+    return value
 
-# Grammar and formatting check
-def check_grammar_formatting(text):
-    """Perform basic grammar and formatting checks on resume text"""
-    prompt = f"""
-    Analyze this resume text for grammatical errors, formatting inconsistencies, and style improvements:
-    
-    {text}
+def create_chat_completion(user_input, context="", use_cache=True, history=None, task='chat', user_id=None, schema=None,
+                           priority=None):
+    """
+    Creates a chat completion using the LM Studio API
+    With optional context and earlier conversation turns for more personalized responses
+    Identical requests are served from the completion cache unless use_cache is False,
+    and identical requests already in flight share one upstream call either way
+    The upstream call waits for a scheduler slot in the task's priority class, or in priority
+    when given, and goes to a backend that serves the task
+    With a JSON schema the reply is a single JSON object, read only up to its closing brace;
+    check it with parse_structured_reply
+    """
+    data = build_chat_request(user_input, context, history=history, task=task, schema=schema)
+    key = CompletionCache.make_key(data)
     
-    Please provide:
-    1. Grammatical errors with corrections
-    2. Formatting inconsistencies and how to fix them
-    3. Style improvements for stronger impact
+    def fetch():
+        with llm_scheduler.slot(priority or LLM_TASKS[task], user_id):
+            if schema:
+                backend, completion = llm_router.complete_json(data, task)
+            else:
+                backend, completion = llm_router.complete(data, task)
+        # A failover answer came from another model than the one the key names, so it isn't cached
+        if use_cache and backend.model == data['model']:
+            completion_cache.set(key, completion)
+        return completion
+    
+    if not use_cache:
+        completion_cache.count('bypassed')
+        return llm_flights.do(key, fetch)
+    
+    completion = completion_cache.get(key)
+    if completion is None:
+        completion = llm_flights.do(key, fetch)
+    return completion
+
+async def create_chat_completion_async(user_input, context="", use_cache=True, history=None, task='chat', user_id=None,
+                                     schema=None, priority=None):
     """
+    Non-blocking create_chat_completion for async views
+    The wait on LM Studio holds no thread; cache lookups run on the default executor
+    """
+    data = build_chat_request(user_input, context, history=history, task=task, schema=schema)
+    key = CompletionCache.make_key(data)
+    
+    async def fetch():
+        async with llm_scheduler.slot_async(priority or LLM_TASKS[task], user_id):
+            backend, completion = await llm_router.complete_async(data, task, json_object=bool(schema))
+        # A failover answer came from another model than the one the key names, so it isn't cached
+        if use_cache and backend.model == data['model']:
+            await asyncio.to_thread(completion_cache.set, key, completion)
+        return completion
+    
+    if not use_cache:
+        completion_cache.count('bypassed')
+        return await llm_flights.do_async(key, fetch)
+    
+    completion = await asyncio.to_thread(completion_cache.get, key)
+    if completion is None:
+        completion = await llm_flights.do_async(key, fetch)
+    return completion
+
+def stream_chat_completion(user_input, context="", history=None, ticket=None):
+    """
+    Streams a chat completion from the LM Studio API
+    Yields content fragments as soon as the model produces them
+    Holds a scheduler slot for the whole stream, waiting on ticket when the caller already queued
+    """
+    data = build_chat_request(user_input, context, stream=True, history=history)
+    ticket = ticket or llm_scheduler.acquire(LLM_TASKS['chat'])
     
     try:
-        completion = create_chat_completion(prompt)
-        return completion['choices'][0]['message']['content']
-    except Exception as e:
-        return f"Error in grammar check: {str(e)}"
+        ticket.wait()
+        backend, response = llm_router.post(data, 'chat', stream=True)
+        try:
+            yield from iter_stream_deltas(response)
+        finally:
+            response.close()
+            llm_router.finish(backend)
+    finally:
+        ticket.release()
 
 # Resume scoring system
-def score_resume(resume_text, job_title=None):
-    """Score a resume based on various factors and return score with feedback"""
-    # Basic metrics
-    word_count = len(resume_text.split())
-    
-    # Readability
-    readability_score = textstat.flesch_reading_ease(resume_text)
-    
-    # Action verbs list (simplified)
-    action_verbs = [
-        'achieved', 'improved', 'launched', 'developed', 'created', 
-        'implemented', 'managed', 'led', 'designed', 'increased',
-        'decreased', 'reduced', 'negotiated', 'coordinated', 'generated',
-        'delivered', 'organized', 'supervised', 'trained', 'analyzed'
-    ]
-    
-    # Count action verbs
-    action_verb_count = sum(1 for word in resume_text.lower().split() if word in action_verbs)
-    
-    # Count bullet points
-    bullet_point_count = resume_text.count('•') + resume_text.count('-') + resume_text.count('*')
-    
-    # Job-specific scoring if job title is provided
-    job_specific_score = 0
-    if job_title:
-        prompt = f"""
+RESUME_FIT_SCHEMA = {
+    'type': 'object',
+    'properties': {
+        'score': {'type': 'integer', 'minimum': 0, 'maximum': 100},
+        'reason': {'type': 'string', 'maxLength': 200}
+    },
+    'required': ['score', 'reason'],
+    'additionalProperties': False
+}
+
+def build_job_fit_prompt(resume_text, job_title):
+    return f"""
         Score this resume for the position of {job_title} on a scale of 0-100.
         Consider relevance, qualifications, and presentation.
         
         Resume:
         {resume_text}
         
-        Provide a numerical score and very brief explanation.
+        Give the score and a one-sentence reason.
         """
-        try:
-            completion = create_chat_completion(prompt)
-            response = completion['choices'][0]['message']['content']
-            # Extract score from response (simple approach)
-            match = re.search(r'(\d{1,3})(?:/100)?', response)
-            if match:
-                job_specific_score = int(match.group(1))
-            else:
-                job_specific_score = 60  # Default if parsing fails
-        except:
-            job_specific_score = 60  # Default on error
+
+async def assess_job_fit(resume_text, job_title, user_id=None):
+    """Ask the model how well a resume fits a job, returning None when it gives no usable answer"""
+    try:
+        # Someone is waiting on the answer, so it runs ahead of batch scoring
+        completion = await create_chat_completion_async(build_job_fit_prompt(resume_text, job_title), task='scoring',
+                                                        user_id=user_id, schema=RESUME_FIT_SCHEMA, priority='interactive')
+        return parse_structured_reply(completion, RESUME_FIT_SCHEMA)
+    except Exception as e:
+        # Without a usable reply the score rests on the resume alone
+        app.logger.warning("Job fit scoring failed, using the resume score only: %s", e)
+        return None
+
+def score_resume_for_job(resume_text, job_fit=None):
+    """Score a resume based on various factors, blended with a job fit from assess_job_fit, and return score with feedback"""
+    # Basic metrics
+    word_count = len(resume_text.split())
+    
+    # Readability; textstat counts syllables with the CMU dictionary, which may not be installed
+    try:
+        ensure_nltk_resource('corpora/cmudict', 'cmudict')
+        readability_score = textstat.flesch_reading_ease(resume_text)
+    except (RuntimeError, LookupError) as e:
+        app.logger.warning("Readability scoring unavailable, using the word count check: %s", e)
+        readability_score = None
+    
+    # Action verbs list (simplified)
+    action_verbs = [
+        'achieved', 'improved', 'launched', 'developed', 'created', 
+        'implemented', 'managed', 'led', 'designed', 'increased',
+        'decreased', 'reduced', 'negotiated', 'coordinated', 'generated',
+        'delivered', 'organized', 'supervised', 'trained', 'analyzed'
+    ]
+    
+    # Count action verbs
+    action_verb_count = sum(1 for word in resume_text.lower().split() if word in action_verbs)
+    
+    # Count bullet points
+    bullet_point_count = resume_text.count('•') + resume_text.count('-') + resume_text.count('*')
     
     # Calculate final score (weighted components)
     base_score = 50
     length_score = min(20, max(0, (word_count - 200) / 20)) if word_count < 600 else max(0, 20 - (word_count - 600) / 50)
-    readability_bonus = min(10, max(0, (readability_score - 30) / 5))
+    readability_bonus = min(10, max(0, (readability_score - 30) / 5)) if readability_score is not None else 0
     action_verb_bonus = min(10, action_verb_count / 2)
     bullet_point_bonus = min(10, bullet_point_count / 3)
     
     total_score = base_score + length_score + readability_bonus + action_verb_bonus + bullet_point_bonus
     
-    if job_title:
-        total_score = (total_score + job_specific_score) / 2
+    if job_fit:
+        total_score = (total_score + job_fit['score']) / 2
     
     # Round to integer
     total_score = round(min(100, max(0, total_score)))
@@ -288,19 +1745,82 @@ def score_resume(resume_text, job_title=None):
     feedback = {
         'score': total_score,
         'length': 'Good length' if 300 <= word_count <= 700 else ('Too short' if word_count < 300 else 'Too long'),
-        'readability': 'Easy to read' if readability_score > 50 else 'Could be more readable',
+        'readability': check_readability(resume_text) if readability_score is None else (
+            'Easy to read' if readability_score > 50 else 'Could be more readable'),
         'action_verbs': f'Used {action_verb_count} action verbs' + (' (good)' if action_verb_count >= 10 else ' (needs more)'),
         'bullet_points': f'Contains {bullet_point_count} bullet points' + (' (good)' if bullet_point_count >= 15 else ' (consider adding more)'),
     }
+    if job_fit:
+        feedback['job_fit'] = job_fit
     
     return feedback
 
+# NLP resources
+# Missing NLTK data is downloaded on first use. Hosts without network access set NLP_OFFLINE,
+# which never downloads and refuses to start while data is missing; `flask warm-nlp` installs it ahead of time
+NLP_OFFLINE = os.environ.get('NLP_OFFLINE', '').lower() in ('1', 'true', 'yes')
+NLP_WARM_UP = os.environ.get('NLP_WARM_UP', 'true').lower() in ('1', 'true', 'yes')
+# NLTK data the app uses, as (resource path, package)
+NLP_RESOURCES = [('sentiment/vader_lexicon.zip', 'vader_lexicon'), ('corpora/cmudict', 'cmudict')]
+
+_sentiment_analyzer = None
+_sentiment_analyzer_lock = threading.Lock()
+
+def ensure_nltk_resource(resource_path, package, download=None):
+    """Make sure an NLTK data package is installed, downloading it only when allowed"""
+    try:
+        nltk.data.find(resource_path)
+    except LookupError:
+        if not (not NLP_OFFLINE if download is None else download):
+            raise RuntimeError(
+                f"NLTK resource '{package}' is not installed. "
+                f"Install it with `flask warm-nlp` or `python -m nltk.downloader {package}`"
+            )
+        if not nltk.download(package, quiet=True):
+            raise RuntimeError(f"Could not download NLTK resource '{package}'")
+
+def get_sentiment_analyzer():
+    """Return the shared VADER analyzer, loading the lexicon on first use"""
+    global _sentiment_analyzer
+    if _sentiment_analyzer is None:
+        with _sentiment_analyzer_lock:
+            if _sentiment_analyzer is None:
+                ensure_nltk_resource('sentiment/vader_lexicon.zip', 'vader_lexicon')
+                _sentiment_analyzer = SentimentIntensityAnalyzer()
+    return _sentiment_analyzer
+
+def check_nlp_resources():
+    """Raise RuntimeError unless every NLTK resource the app uses is installed"""
+    for resource_path, package in NLP_RESOURCES:
+        ensure_nltk_resource(resource_path, package, download=False)
+
+def warm_up_nlp():
+    """Load NLP models now so the first request does not pay for it"""
+    try:
+        get_sentiment_analyzer()
+    except Exception as e:
+        # Keep serving; the analyzer retries on first use
+        app.logger.warning(f"Could not warm up NLP models: {str(e)}")
+    try:
+        ensure_nltk_resource('corpora/cmudict', 'cmudict')
+        # textstat reads the dictionary on first use
+        textstat.syllable_count('resume')
+    except Exception as e:
+        # Resume scoring falls back to the word count check without it
+        app.logger.warning(f"Could not warm up the syllable dictionary: {str(e)}")
+
 # Basic sentiment analysis
 def analyze_sentiment(text):
     """Perform basic sentiment analysis on resume text"""
-    sia = SentimentIntensityAnalyzer()
-    sentiment_scores = sia.polarity_scores(text)
-    
+    return interpret_sentiment(get_sentiment_analyzer().polarity_scores(text))
+
+def analyze_sentiment_batch(texts):
+    """Perform sentiment analysis on many texts with one shared analyzer"""
+    sia = get_sentiment_analyzer()
+    return [interpret_sentiment(sia.polarity_scores(text)) for text in texts]
+
+def interpret_sentiment(sentiment_scores):
+    """Turn VADER polarity scores into a tone and resume advice"""
     # Interpret scores
     if sentiment_scores['compound'] >= 0.05:
         tone = "positive"
@@ -323,6 +1843,273 @@ def analyze_sentiment(text):
         'advice': advice
     }
 
+def build_resume_context(resume):
+    """Describe the resume being discussed for the assistant prompt"""
+    context = f"User is working on a resume titled '{resume['title']}'"
+    if resume['target_job']:
+        context += f" for the position of {resume['target_job']}"
+    return context
+
+# Conversation storage
+CHAT_HISTORY_PAGE_SIZE = int(os.environ.get('CHAT_HISTORY_PAGE_SIZE', 50))
+
+CHAT_GREETING = "Hi! I'm your resume building assistant. I'll help you create or improve your resume. Let's get started! What part of your resume would you like to work on first?"
+
+def get_conversation_id(conn, user_id, resume_id, create=True):
+    """Return the latest conversation for a resume, starting one with a greeting if needed"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT id FROM conversations WHERE resume_id = ? AND user_id = ? ORDER BY created_at DESC LIMIT 1', 
+                  (resume_id, user_id))
+    conversation = cursor.fetchone()
+    
+    if conversation:
+        return conversation['id']
+    if not create:
+        return None
+    
+    cursor.execute(
+        'INSERT INTO conversations (user_id, resume_id, messages) VALUES (?, ?, ?)',
+        (user_id, resume_id, '[]')
+    )
+    conversation_id = cursor.lastrowid
+    append_messages(conn, conversation_id, [{"role": "assistant", "content": CHAT_GREETING}])
+    return conversation_id
+
+def append_messages(conn, conversation_id, messages):
+    """Append messages to a conversation without touching the ones already stored"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM messages WHERE conversation_id = ?', (conversation_id,))
+    last_seq = cursor.fetchone()[0]
+    cursor.executemany(
+        'INSERT INTO messages (conversation_id, seq, role, content) VALUES (?, ?, ?, ?)',
+        [(conversation_id, last_seq + offset, message['role'], message['content'])
+         for offset, message in enumerate(messages, start=1)]
+    )
+
+def load_messages(conn, conversation_id, limit=None, before_seq=None):
+    """Load the most recent messages of a conversation (older than before_seq), oldest first"""
+    cursor = conn.cursor()
+    cursor.execute(
+        'SELECT seq, role, content, created_at FROM messages '
+        'WHERE conversation_id = ? AND seq < ? ORDER BY seq DESC LIMIT ?',
+        (conversation_id, before_seq if before_seq is not None else 2 ** 62, limit or CHAT_HISTORY_PAGE_SIZE)
+    )
+    return cursor.fetchall()[::-1]
+
+def save_conversation_turn(user_id, resume_id, user_input, ai_response):
+    """Append a user/assistant exchange to the latest conversation for a resume"""
+    conn = get_db()
+    conversation_id = get_conversation_id(conn, user_id, resume_id)
+    append_messages(conn, conversation_id, [
+        {"role": "user", "content": user_input},
+        {"role": "assistant", "content": ai_response}
+    ])
+    conn.commit()
+
+# Chat context window
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.environ.get('CHAT_CONTEXT_TOKEN_BUDGET', 2048))
+CHAT_CONTEXT_SECTION_SHARE = float(os.environ.get('CHAT_CONTEXT_SECTION_SHARE', 0.4))
+CHAT_CONTEXT_MAX_MESSAGES = int(os.environ.get('CHAT_CONTEXT_MAX_MESSAGES', 100))
+CHAT_SUMMARY_ENABLED = os.environ.get('CHAT_SUMMARY_ENABLED', '').lower() in ('1', 'true', 'yes')
+CHAT_SUMMARY_TOKENS = int(os.environ.get('CHAT_SUMMARY_TOKENS', 200))
+CHAT_SUMMARY_INPUT_TOKENS = int(os.environ.get('CHAT_SUMMARY_INPUT_TOKENS', 3000))
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text):
+    """Approximate a BPE token count locally: one per word or symbol, plus one per 4 extra characters in long words"""
+    return sum(1 + max(0, len(piece) - 4) // 4 for piece in TOKEN_RE.findall(text))
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to roughly max_tokens, keeping the beginning"""
+    if max_tokens <= 0:
+        return ""
+    total = 0
+    for match in TOKEN_RE.finditer(text):
+        total += 1 + max(0, len(match.group()) - 4) // 4
+        if total > max_tokens:
+            return text[:match.start()].rstrip() + " ..."
+    return text
+
+def rank_sections(sections, user_input):
+    """Order non-empty sections by how much they overlap with the user's question"""
+    query_words = set(WORD_RE.findall(user_input.lower()))
+    ranked = []
+    for position, section in enumerate(sections):
+        if not section['content'].strip():
+            continue
+        name_words = set(WORD_RE.findall(section['section_name'].lower()))
+        content_words = set(WORD_RE.findall(section['content'].lower()))
+        # A section named in the question beats one that merely shares words with it
+        relevance = 3 * len(query_words & name_words) + len(query_words & content_words)
+        ranked.append((-relevance, position, section))
+    ranked.sort(key=lambda item: item[:2])
+    return [section for _, _, section in ranked]
+
+def summarize_turns(previous_summary, messages, user_id=None):
+    """Ask the model for a short running summary of older conversation turns, queued as user_id's request"""
+    transcript = [f"{message['role']}: {message['content']}" for message in messages]
+    # Keep the newest turns if the transcript is too long to summarize in one go
+    while len(transcript) > 1 and count_tokens("\n".join(transcript)) > CHAT_SUMMARY_INPUT_TOKENS:
+        transcript.pop(0)
+    
+    prompt = f"""
+    Summarize this resume-coaching conversation in at most {CHAT_SUMMARY_TOKENS} words.
+    Keep facts about the user, their experience and the advice already given.
+    
+    Summary so far:
+    {previous_summary or 'None'}
+    
+    New turns:
+    {chr(10).join(transcript)}
+    """
+    completion = create_chat_completion(prompt, task='summary', user_id=user_id)
+    return truncate_to_tokens(completion['choices'][0]['message']['content'].strip(), CHAT_SUMMARY_TOKENS)
+
+def get_conversation_summary(conn, conversation_id, through_seq, user_id=None):
+    """Return a summary of messages up to through_seq, extending the cached one when needed"""
+    cursor = conn.cursor()
+    cursor.execute('SELECT through_seq, summary FROM conversation_summaries WHERE conversation_id = ?', (conversation_id,))
+    cached = cursor.fetchone()
+    
+    if cached and cached['through_seq'] >= through_seq:
+        return cached['summary']
+    
+    start_seq = cached['through_seq'] if cached else 0
+    cursor.execute(
+        'SELECT role, content FROM messages WHERE conversation_id = ? AND seq > ? AND seq <= ? ORDER BY seq',
+        (conversation_id, start_seq, through_seq)
+    )
+    summary = summarize_turns(cached['summary'] if cached else None, cursor.fetchall(), user_id)
+    
+    cursor.execute(
+        'INSERT OR REPLACE INTO conversation_summaries (conversation_id, through_seq, summary) VALUES (?, ?, ?)',
+        (conversation_id, through_seq, summary)
+    )
+    conn.commit()
+    return summary
+
+def build_chat_context(conn, conversation_id, resume, sections, user_input, user_id=None):
+    """
+    Assemble the prompt context and prior turns for a chat reply within CHAT_CONTEXT_TOKEN_BUDGET
+    Returns (context, history); the oldest turns are dropped (or summarized) first
+    A summary request counts against user_id's share of the LLM queue
+    """
+    context = build_resume_context(resume)
+    remaining = CHAT_CONTEXT_TOKEN_BUDGET - count_tokens(build_resume_prompt(user_input, context))
+    
+    # Most relevant resume sections first, within their share of the budget
+    section_budget = int(max(0, remaining) * CHAT_CONTEXT_SECTION_SHARE)
+    section_parts = []
+    for section in rank_sections(sections, user_input):
+        if section_budget <= 20:
+            break
+        part = truncate_to_tokens(f"{section['section_name']}:\n{section['content'].strip()}", section_budget)
+        section_parts.append(part)
+        section_budget -= count_tokens(part)
+    if section_parts:
+        context += "\n\nRelevant resume sections:\n" + "\n\n".join(section_parts)
+    remaining = CHAT_CONTEXT_TOKEN_BUDGET - count_tokens(build_resume_prompt(user_input, context))
+    
+    if conversation_id is None or remaining <= 0:
+        return context, []
+    
+    messages = load_messages(conn, conversation_id, limit=CHAT_CONTEXT_MAX_MESSAGES)
+    
+    # Newest turns first until the budget runs out
+    history_budget = remaining - (CHAT_SUMMARY_TOKENS if CHAT_SUMMARY_ENABLED else 0)
+    kept = []
+    for message in reversed(messages):
+        cost = count_tokens(message['content']) + 4
+        if cost > history_budget:
+            break
+        kept.append(message)
+        history_budget -= cost
+    kept.reverse()
+    
+    # The model expects turns to start with the user, so drop a leading assistant message
+    while kept and kept[0]['role'] != 'user':
+        kept.pop(0)
+    
+    first_kept_seq = kept[0]['seq'] if kept else (messages[-1]['seq'] + 1 if messages else 1)
+    if CHAT_SUMMARY_ENABLED and first_kept_seq > 2:
+        try:
+            summary = get_conversation_summary(conn, conversation_id, first_kept_seq - 1, user_id)
+            context += "\n\nEarlier in this conversation:\n" + summary
+        except Exception:
+            # Without a summary the reply still has the most recent turns
+            pass
+    
+    history = [{"role": message['role'], "content": message['content']} for message in kept]
+    return context, history
+
+def sse_event(data, event=None):
+    """Format a Server-Sent Events frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+# Full-text resume search
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+SEARCH_MAX_PAGE_SIZE = 100
+# Words as the unicode61 tokenizer splits them, with an optional trailing * for a prefix search
+SEARCH_TERM_RE = re.compile(r"([^\W_]+)(\*?)")
+# Control characters that mark snippet matches until the snippet has been escaped
+SNIPPET_OPEN, SNIPPET_CLOSE = '\x02', '\x03'
+
+def build_search_query(query, user_id=None):
+    """Turn free text into an FTS5 query in which every word must match"""
+    terms = SEARCH_TERM_RE.findall(query.lower())
+    if not terms:
+        return None
+    # Prefixes expand to every matching term in the index, so very short ones are searched exactly
+    quoted = [f'"{term}"*' if star and len(term) >= 3 else f'"{term}"' for term, star in terms]
+    match = '{title target_job section_name content} : (' + ' '.join(quoted) + ')'
+    if user_id is not None:
+        match = f'user_id : "{int(user_id)}" AND {match}'
+    return match
+
+def search_resumes(conn, query, user_id=None, limit=SEARCH_PAGE_SIZE, offset=0):
+    """Rank resumes by their best matching section; returns (results, has_more)"""
+    match = build_search_query(query, user_id)
+    if not match:
+        return [], False
+    
+    # Rank and page on the index alone (rank is the weighted bm25 configured in the migration),
+    # then build snippets only for the rows on this page
+    hits = conn.execute('''
+    SELECT resume_id, rowid AS section_id, MIN(rank) AS score
+    FROM resume_search WHERE resume_search MATCH ?
+    GROUP BY resume_id ORDER BY score LIMIT ? OFFSET ?
+    ''', (match, limit + 1, offset)).fetchall()
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+    if not hits:
+        return [], False
+    
+    placeholders = ','.join('?' * len(hits))
+    section_ids = [hit['section_id'] for hit in hits]
+    details = {row['rowid']: row for row in conn.execute(f'''
+    SELECT rowid, title, target_job, section_name,
+           snippet(resume_search, -1, '{SNIPPET_OPEN}', '{SNIPPET_CLOSE}', '…', 16) AS snippet
+    FROM resume_search WHERE resume_search MATCH ? AND rowid IN ({placeholders})
+    ''', [match] + section_ids)}
+    
+    results = []
+    for hit in hits:
+        row = details[hit['section_id']]
+        # Escape the user's text, then turn the match markers into highlighting
+        snippet = str(escape(row['snippet'])).replace(SNIPPET_OPEN, '<mark>').replace(SNIPPET_CLOSE, '</mark>')
+        results.append({
+            'resume_id': hit['resume_id'],
+            'section_id': hit['section_id'],
+            'title': row['title'],
+            'target_job': row['target_job'],
+            'section_name': row['section_name'],
+            'snippet': snippet,
+            'score': round(-hit['score'], 3)
+        })
+    return results, has_more
+
 # Routes
 @app.route('/')
 def index():
@@ -340,13 +2127,12 @@ def register():
         # Hash password
         hashed_password = generate_password_hash(password)
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # Check if username or email already exists
         cursor.execute('SELECT * FROM users WHERE username = ? OR email = ?', (username, email))
         if cursor.fetchone():
-            conn.close()
             flash('Username or email already exists. Please choose another or login.')
             return redirect(url_for('register'))
         
@@ -358,7 +2144,6 @@ def register():
         
         conn.commit()
         user_id = cursor.lastrowid
-        conn.close()
         
         # Set session
         session['user_id'] = user_id
@@ -375,12 +2160,11 @@ def login():
         username = request.form['username']
         password = request.form['password']
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
         user = cursor.fetchone()
-        conn.close()
         
         if user and check_password_hash(user['password'], password):
             session['user_id'] = user['id']
@@ -405,16 +2189,44 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
-    # Get user's resumes
-    cursor.execute('SELECT * FROM resumes WHERE user_id = ? ORDER BY updated_at DESC', (session['user_id'],))
+    # Get user's resumes, flagging those with a score still being computed
+    cursor.execute('''
+    SELECT resumes.*, EXISTS (
+        SELECT 1 FROM jobs
+        WHERE jobs.resume_id = resumes.id AND jobs.job_type = 'score_resume'
+        AND jobs.status IN ('pending', 'running')
+    ) AS score_pending
+    FROM resumes WHERE user_id = ? ORDER BY updated_at DESC
+    ''', (session['user_id'],))
     resumes = cursor.fetchall()
     
-    conn.close()
+    # Optional full-text search over the user's resumes
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    search_results, has_more = [], False
+    if query:
+        search_results, has_more = search_resumes(conn, query, session['user_id'], offset=(page - 1) * SEARCH_PAGE_SIZE)
     
-    return render_template('dashboard.html', resumes=resumes)
+    return render_template('dashboard.html', resumes=resumes, query=query, page=page,
+                           search_results=search_results, has_more=has_more)
+
+@app.route('/api/search')
+@login_required
+def api_search():
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', SEARCH_PAGE_SIZE, type=int), 1), SEARCH_MAX_PAGE_SIZE)
+    
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    
+    results, has_more = search_resumes(get_db(), query, session['user_id'], limit=per_page, offset=(page - 1) * per_page)
+    for result in results:
+        result['url'] = url_for('view_resume', resume_id=result['resume_id'])
+    return jsonify({'query': query, 'page': page, 'per_page': per_page, 'has_more': has_more, 'results': results})
 
 @app.route('/resume/new', methods=['GET', 'POST'])
 @login_required
@@ -423,7 +2235,7 @@ def new_resume():
         title = request.form['title']
         target_job = request.form['target_job'] if 'target_job' in request.form else ''
         
-        conn = get_db_connection()
+        conn = get_db()
         cursor = conn.cursor()
         
         # Create new resume
@@ -443,14 +2255,13 @@ def new_resume():
             ('Additional Sections', '')
         ]
         
-        for section_name, content in default_sections:
-            cursor.execute(
-                'INSERT INTO resume_sections (resume_id, section_name, content) VALUES (?, ?, ?)',
-                (resume_id, section_name, content)
-            )
+        cursor.executemany(
+            'INSERT INTO resume_sections (resume_id, section_name, content, position) VALUES (?, ?, ?, ?)',
+            [(resume_id, section_name, content, (index + 1) * SECTION_POSITION_GAP)
+             for index, (section_name, content) in enumerate(default_sections)]
+        )
         
         conn.commit()
-        conn.close()
         
         return redirect(url_for('edit_resume', resume_id=resume_id))
     
@@ -459,7 +2270,7 @@ def new_resume():
 @app.route('/resume/<int:resume_id>')
 @login_required
 def view_resume(resume_id):
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get resume
@@ -467,26 +2278,23 @@ def view_resume(resume_id):
     resume = cursor.fetchone()
     
     if not resume:
-        conn.close()
         flash('Resume not found or access denied')
         return redirect(url_for('dashboard'))
     
     # Get sections
-    cursor.execute('SELECT * FROM resume_sections WHERE resume_id = ?', (resume_id,))
+    cursor.execute('SELECT * FROM resume_sections WHERE resume_id = ? ORDER BY position', (resume_id,))
     sections = cursor.fetchall()
     
     # Get templates
-    cursor.execute('SELECT id, name, description FROM templates')
-    templates = cursor.fetchall()
+    templates = resume_templates.all()
     
-    conn.close()
     
     return render_template('view_resume.html', resume=resume, sections=sections, templates=templates)
 
 @app.route('/resume/<int:resume_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_resume(resume_id):
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get resume
@@ -494,130 +2302,254 @@ def edit_resume(resume_id):
     resume = cursor.fetchone()
     
     if not resume:
-        conn.close()
         flash('Resume not found or access denied')
         return redirect(url_for('dashboard'))
     
     # Get sections
-    cursor.execute('SELECT * FROM resume_sections WHERE resume_id = ?', (resume_id,))
+    cursor.execute('SELECT * FROM resume_sections WHERE resume_id = ? ORDER BY position', (resume_id,))
     sections = cursor.fetchall()
     
     if request.method == 'POST':
-        # Update resume title and target job
         title = request.form['title']
         target_job = request.form.get('target_job', '')
         
-        cursor.execute(
-            'UPDATE resumes SET title = ?, target_job = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?', 
-            (title, target_job, resume_id)
-        )
+        # Diff the submitted sections against the stored ones; a section left out of the form is unchanged
+        submitted = {section['id']: request.form.get(f'section_{section["id"]}', section['content']) for section in sections}
+        changed_sections = [(submitted[section['id']], section['id'])
+                            for section in sections if submitted[section['id']] != section['content']]
+        details_changed = title != resume['title'] or target_job != (resume['target_job'] or '')
+        rows_written = 0
         
-        # Update sections
-        for section in sections:
-            section_content = request.form.get(f'section_{section["id"]}', '')
+        if changed_sections:
+            cursor.executemany('UPDATE resume_sections SET content = ? WHERE id = ?', changed_sections)
+            rows_written += len(changed_sections)
+        
+        if changed_sections or details_changed:
+            # Compile full content for scoring
+            full_content = "\n\n".join(submitted[section['id']] for section in sections)
             cursor.execute(
-                'UPDATE resume_sections SET content = ? WHERE id = ?',
-                (section_content, section["id"])
+                'UPDATE resumes SET title = ?, target_job = ?, content = ?, revision = revision + 1, '
+                'updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                (title, target_job, full_content, resume_id)
             )
+            rows_written += 1
+            
+            # The score depends on the content and target job only; it is filled in by a background job
+            rescore = bool(changed_sections) or target_job != (resume['target_job'] or '')
+            if rescore:
+                job_queue.enqueue('score_resume', resume_id, conn)
+            
+            conn.commit()
+            if rescore:
+                job_queue.notify()
+            export_cache.invalidate(resume_id)
         
-        # Compile full content for scoring
-        full_content = "\n\n".join(request.form.get(f'section_{section["id"]}', '') for section in sections)
+        # Autosave requests get a JSON summary instead of a redirect
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'rows_written': rows_written, 'sections_changed': len(changed_sections)})
         
-        # Score resume
-        score_result = score_resume(full_content, target_job)
+        if rows_written:
+            flash(f'Resume updated successfully! ({len(changed_sections)} section(s) changed)')
+        else:
+            flash('No changes to save.')
+        return redirect(url_for('view_resume', resume_id=resume_id))
+    
+    return render_template('edit_resume.html', resume=resume, sections=sections)
 
-        # Ensure `score_result` is a dictionary
-        if isinstance(score_result, int):
-            score_result = {"score": score_result}  # Convert to dictionary
-        
-        # Update resume content and score
-        cursor.execute(
-            'UPDATE resumes SET content = ?, score = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-            (full_content, score_result['score'], resume_id)
-        )
+def refresh_resume_content(conn, resume_id, rescore=True):
+    """Recompile a resume's content from its ordered sections and bump its revision"""
+    rows = conn.execute('SELECT content FROM resume_sections WHERE resume_id = ? ORDER BY position', (resume_id,)).fetchall()
+    conn.execute(
+        'UPDATE resumes SET content = ?, revision = revision + 1, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+        ("\n\n".join(row['content'] for row in rows), resume_id)
+    )
+    if rescore:
+        job_queue.enqueue('score_resume', resume_id, conn)
+
+def longest_increasing_run(values):
+    """Indexes of a longest strictly increasing subsequence of values"""
+    tails = []
+    tail_indexes = []
+    previous = [None] * len(values)
+    for index, value in enumerate(values):
+        slot = bisect.bisect_left(tails, value)
+        if slot == len(tails):
+            tails.append(value)
+            tail_indexes.append(index)
+        else:
+            tails[slot] = value
+            tail_indexes[slot] = index
+        previous[index] = tail_indexes[slot - 1] if slot else None
+    
+    keep = set()
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        keep.add(index)
+        index = previous[index]
+    return keep
+
+def plan_section_positions(current, ordered_ids):
+    """Work out new positions for a reordered list of sections, moving as few rows as possible.
+    
+    Sections that are already in relative order keep their positions; the rest are spread into
+    the gaps between their neighbours. Returns (position, section_id) pairs to write, or every
+    section renumbered when a gap has run out of room.
+    """
+    positions = [current[section_id] for section_id in ordered_ids]
+    keep = longest_increasing_run(positions)
+    updates = []
+    
+    index = 0
+    while index < len(ordered_ids):
+        if index in keep:
+            index += 1
+            continue
         
-        conn.commit()
-        conn.close()
+        # A run of moved sections between two anchors that stay put
+        end = index
+        while end < len(ordered_ids) and end not in keep:
+            end += 1
+        run = ordered_ids[index:end]
+        low = positions[index - 1] if index > 0 else None
+        high = positions[end] if end < len(ordered_ids) else None
+        if low is None:
+            low = (high if high is not None else 0) - SECTION_POSITION_GAP * (len(run) + 1)
+        if high is None:
+            high = low + SECTION_POSITION_GAP * (len(run) + 1)
         
-        flash('Resume updated successfully!')
-        return redirect(url_for('view_resume', resume_id=resume_id))
+        step = (high - low) // (len(run) + 1)
+        if step < 1:
+            return [((offset + 1) * SECTION_POSITION_GAP, section_id) for offset, section_id in enumerate(ordered_ids)]
+        updates.extend((low + step * (offset + 1), section_id) for offset, section_id in enumerate(run))
+        index = end
     
-    conn.close()
-    
-    return render_template('edit_resume.html', resume=resume, sections=sections)
+    return updates
 
-@app.route('/resume/<int:resume_id>/chat', methods=['GET', 'POST'])
+def get_owned_section(conn, section_id):
+    return conn.execute(
+        'SELECT resume_sections.* FROM resume_sections JOIN resumes ON resumes.id = resume_sections.resume_id '
+        'WHERE resume_sections.id = ? AND resumes.user_id = ?',
+        (section_id, session['user_id'])
+    ).fetchone()
+
+@app.route('/api/add_section', methods=['POST'])
 @login_required
-def resume_chat(resume_id):
-    conn = get_db_connection()
+def api_add_section():
+    resume_id = request.json.get('resume_id')
+    section_name = (request.json.get('section_name') or '').strip()
+    
+    if not section_name:
+        return jsonify({'error': 'Section name is required'}), 400
+    
+    conn = get_db()
     cursor = conn.cursor()
+    cursor.execute('SELECT id FROM resumes WHERE id = ? AND user_id = ?', (resume_id, session['user_id']))
+    if not cursor.fetchone():
+        return jsonify({'error': 'Resume not found'}), 404
+    
+    # New sections go after the last one
+    cursor.execute(
+        'INSERT INTO resume_sections (resume_id, section_name, content, position) '
+        'SELECT ?, ?, ?, COALESCE(MAX(position), 0) + ? FROM resume_sections WHERE resume_id = ?',
+        (resume_id, section_name, '', SECTION_POSITION_GAP, resume_id)
+    )
+    section_id = cursor.lastrowid
+    refresh_resume_content(conn, resume_id, rescore=False)
+    conn.commit()
+    export_cache.invalidate(resume_id)
     
-    # Get resume
-    cursor.execute('SELECT * FROM resumes WHERE id = ? AND user_id = ?', (resume_id, session['user_id']))
-    resume = cursor.fetchone()
+    return jsonify({'success': True, 'section_id': section_id})
+
+@app.route('/api/delete_section', methods=['POST'])
+@login_required
+def api_delete_section():
+    conn = get_db()
+    section = get_owned_section(conn, request.json.get('section_id'))
     
-    if not resume:
-        conn.close()
-        flash('Resume not found or access denied')
-        return redirect(url_for('dashboard'))
+    if not section:
+        return jsonify({'error': 'Section not found'}), 404
     
-    # Get sections
-    cursor.execute('SELECT * FROM resume_sections WHERE resume_id = ?', (resume_id,))
-    sections = cursor.fetchall()
+    conn.execute('DELETE FROM resume_sections WHERE id = ?', (section['id'],))
+    conn.execute('DELETE FROM section_metrics WHERE section_id = ?', (section['id'],))
+    # Only an empty section can be dropped without changing the score
+    refresh_resume_content(conn, section['resume_id'], rescore=bool(section['content'].strip()))
+    conn.commit()
+    job_queue.notify()
+    export_cache.invalidate(section['resume_id'])
     
-    # Get or initialize conversation
-    cursor.execute('SELECT * FROM conversations WHERE resume_id = ? AND user_id = ? ORDER BY created_at DESC LIMIT 1', 
-                  (resume_id, session['user_id']))
-    conversation = cursor.fetchone()
+    return jsonify({'success': True})
+
+@app.route('/api/update_sections_order', methods=['POST'])
+@login_required
+def api_update_sections_order():
+    resume_id = request.json.get('resume_id')
     
-    if conversation:
-        messages = json.loads(conversation['messages'])
-    else:
-        # Start new conversation
-        initial_message = {
-            "role": "assistant", 
-            "content": "Hi! I'm your resume building assistant. I'll help you create or improve your resume. Let's get started! What part of your resume would you like to work on first?"
-        }
-        messages = [initial_message]
-        cursor.execute(
-            'INSERT INTO conversations (user_id, resume_id, messages) VALUES (?, ?, ?)',
-            (session['user_id'], resume_id, json.dumps(messages))
-        )
+    try:
+        section_ids = [int(section_id) for section_id in request.json.get('section_ids') or []]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'section_ids must be integers'}), 400
+    
+    conn = get_db()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id FROM resumes WHERE id = ? AND user_id = ?', (resume_id, session['user_id']))
+    if not cursor.fetchone():
+        return jsonify({'error': 'Resume not found'}), 404
+    
+    cursor.execute('SELECT id, position FROM resume_sections WHERE resume_id = ?', (resume_id,))
+    current = {row['id']: row['position'] for row in cursor.fetchall()}
+    if sorted(section_ids) != sorted(current):
+        return jsonify({'error': 'section_ids must list every section of the resume exactly once'}), 400
+    
+    updates = plan_section_positions(current, section_ids)
+    if updates:
+        cursor.executemany('UPDATE resume_sections SET position = ? WHERE id = ?', updates)
+        refresh_resume_content(conn, resume_id, rescore=False)
         conn.commit()
-        conversation_id = cursor.lastrowid
+        export_cache.invalidate(resume_id)
+    
+    return jsonify({'success': True, 'rows_written': len(updates)})
+
+def get_owned_resume(conn, user_id, resume_id):
+    return conn.execute('SELECT * FROM resumes WHERE id = ? AND user_id = ?', (resume_id, user_id)).fetchone()
+
+def open_resume_chat(conn, user_id, resume_id):
+    """A resume the user owns, its sections and its conversation id; (None, None, None) when not found"""
+    resume = get_owned_resume(conn, user_id, resume_id)
+    if not resume:
+        return None, None, None
+    sections = conn.execute('SELECT * FROM resume_sections WHERE resume_id = ? ORDER BY position', (resume_id,)).fetchall()
+    return resume, sections, get_conversation_id(conn, user_id, resume_id)
+
+@app.route('/resume/<int:resume_id>/chat', methods=['GET', 'POST'])
+@login_required
+async def resume_chat(resume_id):
+    # Resume, sections and the conversation, created on first visit
+    resume, sections, conversation_id = await run_in_db(open_resume_chat, session['user_id'], resume_id)
+    
+    if not resume:
+        flash('Resume not found or access denied')
+        return redirect(url_for('dashboard'))
     
     if request.method == 'POST':
         user_input = request.form['user_input']
         
-        # Add user message
-        messages.append({"role": "user", "content": user_input})
-        
-        # Create context based on resume content
-        context = f"User is working on a resume titled '{resume['title']}'"
-        if resume['target_job']:
-            context += f" for the position of {resume['target_job']}"
-        
         # Get AI response
         try:
-            completion = create_chat_completion(user_input, context)
-            ai_response = completion['choices'][0]['message']['content']
+            # Resume context plus as much recent conversation as the token budget allows; this can
+            # also ask the model for a summary of older turns
+            context, history = await run_in_db(build_chat_context, conversation_id, resume, sections, user_input,
+                                               session['user_id'])
             
-            # Add AI message
-            messages.append({"role": "assistant", "content": ai_response})
-            
-            # Update conversation in database
-            if conversation:
-                cursor.execute(
-                    'UPDATE conversations SET messages = ? WHERE id = ?',
-                    (json.dumps(messages), conversation['id'])
-                )
-            else:
-                cursor.execute(
-                    'INSERT INTO conversations (user_id, resume_id, messages) VALUES (?, ?, ?)',
-                    (session['user_id'], resume_id, json.dumps(messages))
-                )
+            # Don't hold a pooled connection while waiting on the model
+            release_db(None)
+            completion = await create_chat_completion_async(user_input, context, history=history, user_id=session['user_id'])
+            ai_response = completion['choices'][0]['message']['content']
             
-            conn.commit()
+            # Append both messages to the conversation
+            await run_in_db(append_messages, conversation_id, [
+                {"role": "user", "content": user_input},
+                {"role": "assistant", "content": ai_response}
+            ])
             
             # Check if response contains section updates
             update_section = None
@@ -639,14 +2571,15 @@ def resume_chat(resume_id):
         except Exception as e:
             flash(f'Error getting response: {str(e)}')
     
-    conn.close()
+    # Only the most recent page of messages; older ones load on demand
+    messages = await run_in_db(load_messages, conversation_id)
     
     return render_template('resume_chat.html', resume=resume, sections=sections, messages=messages)
 
 @app.route('/resume/<int:resume_id>/analyze', methods=['GET', 'POST'])
 @login_required
 def analyze_resume(resume_id):
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get resume
@@ -654,12 +2587,11 @@ def analyze_resume(resume_id):
     resume = cursor.fetchone()
     
     if not resume:
-        conn.close()
         flash('Resume not found or access denied')
         return redirect(url_for('dashboard'))
     
     # Get sections
-    cursor.execute('SELECT * FROM resume_sections WHERE resume_id = ?', (resume_id,))
+    cursor.execute('SELECT * FROM resume_sections WHERE resume_id = ? ORDER BY position', (resume_id,))
     sections = cursor.fetchall()
     
     analysis = {}
@@ -668,64 +2600,172 @@ def analyze_resume(resume_id):
         content = resume['content']
         job_description = request.form.get('job_description', '')
         
+        # Combine cached per-section metrics; every helper below reuses them
+        metrics = get_sectioned_resume_metrics(conn, resume_id, sections)
+        conn.commit()
+        
         # Basic analyses
-        analysis['score'] = score_resume(content, resume['target_job'])
-        analysis['length'] = f"{len(content.split())} words"
-        analysis['readability'] = check_readability(content)
-        analysis['action_verbs'] = f"Used {count_action_verbs(content)} action verbs"
-        analysis['bullet_points'] = f"Contains {content.count('•')} bullet points"
+        analysis['score'] = score_resume(metrics, resume['target_job'])
+        analysis['length'] = f"{metrics.word_count} words"
+        analysis['readability'] = check_readability(metrics)
+        analysis['action_verbs'] = f"Used {metrics.action_verb_count} action verbs"
+        analysis['bullet_points'] = f"Contains {metrics.bullet_count} bullet points"
         
         # Additional analyses
-        analysis['strengths'] = identify_strengths(content, resume['target_job'])
-        analysis['areas_for_improvement'] = identify_improvements(content, resume['target_job'])
+        analysis['strengths'] = identify_strengths(metrics, resume['target_job'])
+        analysis['areas_for_improvement'] = identify_improvements(metrics, resume['target_job'])
         analysis['section_feedback'] = generate_section_feedback(sections)
-        analysis['recommendations'] = generate_recommendations(content, resume['target_job'])
+        analysis['recommendations'] = generate_recommendations(metrics, resume['target_job'])
         
         if job_description:
             analysis['ats'] = optimize_for_ats(content, job_description)
         
         analysis['grammar'] = check_grammar_formatting(content)
     
-    conn.close()
     
     return render_template('analyze_resume.html', resume=resume, sections=sections, analysis=analysis)
 
+# Resume text metrics
+ACTION_VERBS = ("developed", "created", "managed", "led", "implemented", "designed", 
+                "coordinated", "achieved", "improved", "reduced", "increased", "generated")
+TECH_SKILLS = ("python", "java", "javascript", "react", "node", "sql", "aws", "docker")
+COMMON_KEYWORDS = ("python", "java", "javascript", "agile", "scrum", "leadership", 
+                   "development", "software", "engineering", "team", "project")
+ATS_KEYWORDS = ("experience", "teamwork", "communication", "leadership", 
+                "project management", "software development", "problem-solving")
+EXPERIENCE_INDICATORS = ("years of experience", "led team", "managed project")
+PAST_TENSE_VERBS = ("developed", "created", "managed", "led")
+PRESENT_TENSE_VERBS = ("develop", "create", "manage", "lead")
+
+# Every phrase an analyzer looks up, checked once per document
+ANALYZER_PHRASES = frozenset(TECH_SKILLS + COMMON_KEYWORDS + ATS_KEYWORDS + EXPERIENCE_INDICATORS + ("education", "skills"))
+
+WORD_RE = re.compile(r"[a-z]+")
+DIGIT_RE = re.compile(r"\d")
+
+# Counters that add up across sections; phrases combine by union
+METRIC_COUNTS = ('word_count', 'action_verb_count', 'past_tense_count', 'present_tense_count', 'bullet_count', 'digit_count')
+
+class ResumeMetrics:
+    """Text statistics computed in one pass and shared by all of the heuristic analyzers"""
+    
+    def __init__(self, content):
+        lower = content.lower()
+        self.word_count = len(content.split())
+        
+        # Whole-word frequencies, so "Developed," and a line-initial "Led" both count
+        words = Counter(WORD_RE.findall(lower))
+        self.action_verb_count = sum(words[verb] for verb in ACTION_VERBS)
+        self.past_tense_count = sum(words[verb] for verb in PAST_TENSE_VERBS)
+        self.present_tense_count = sum(words[verb] for verb in PRESENT_TENSE_VERBS)
+        
+        self.bullet_count = content.count('•')
+        self.digit_count = len(DIGIT_RE.findall(content))
+        self.phrases = frozenset(phrase for phrase in ANALYZER_PHRASES if phrase in lower)
+    
+    @classmethod
+    def from_values(cls, phrases, **counts):
+        metrics = cls.__new__(cls)
+        for name in METRIC_COUNTS:
+            setattr(metrics, name, counts.get(name, 0))
+        metrics.phrases = frozenset(phrases)
+        return metrics
+    
+    @classmethod
+    def combine(cls, parts):
+        """Metrics of sections joined with blank lines, built from each section's metrics.
+
+        No word or analyzer phrase can span a blank line, so the result matches analyzing the
+        joined text directly.
+        """
+        parts = list(parts)
+        return cls.from_values(
+            frozenset().union(*(part.phrases for part in parts)),
+            **{name: sum(getattr(part, name) for part in parts) for name in METRIC_COUNTS}
+        )
+
+@lru_cache(maxsize=256)
+def compute_resume_metrics(content):
+    return ResumeMetrics(content)
+
+def get_resume_metrics(content):
+    """Return the (cached) metrics for a piece of resume text, or pass through precomputed metrics"""
+    if isinstance(content, ResumeMetrics):
+        return content
+    return compute_resume_metrics(content)
+
+def get_section_metrics(conn, sections):
+    """Metrics for each section, re-analyzing only sections whose content changed since they were stored.
+
+    Writes refreshed rows to section_metrics; the caller commits.
+    """
+    section_ids = [section['id'] for section in sections]
+    if not section_ids:
+        return []
+    
+    placeholders = ','.join('?' * len(section_ids))
+    stored = {row['section_id']: row for row in conn.execute(
+        f'SELECT * FROM section_metrics WHERE section_id IN ({placeholders})', section_ids
+    )}
+    
+    results = []
+    dirty = []
+    for section in sections:
+        content_hash = hashlib.sha1(section['content'].encode('utf-8')).hexdigest()
+        row = stored.get(section['id'])
+        if row and row['content_hash'] == content_hash:
+            metrics = ResumeMetrics.from_values(json.loads(row['phrases']), **{name: row[name] for name in METRIC_COUNTS})
+        else:
+            metrics = get_resume_metrics(section['content'])
+            dirty.append((section['id'], content_hash, json.dumps(sorted(metrics.phrases)))
+                         + tuple(getattr(metrics, name) for name in METRIC_COUNTS))
+        results.append(metrics)
+    
+    if dirty:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO section_metrics (section_id, content_hash, phrases, {', '.join(METRIC_COUNTS)}) "
+            f"VALUES ({','.join('?' * (3 + len(METRIC_COUNTS)))})",
+            dirty
+        )
+    return results
+
+def get_sectioned_resume_metrics(conn, resume_id, sections=None):
+    """Resume-level metrics combined from the cached per-section metrics"""
+    if sections is None:
+        sections = conn.execute(
+            'SELECT id, content FROM resume_sections WHERE resume_id = ? ORDER BY position', (resume_id,)
+        ).fetchall()
+    return ResumeMetrics.combine(get_section_metrics(conn, sections))
+
 # Helper functions
 def check_readability(content):
     # Simple readability check (can be enhanced with proper readability algorithms)
-    words = content.split()
-    if len(words) < 200:
+    word_count = get_resume_metrics(content).word_count
+    if word_count < 200:
         return "Too short"
-    elif len(words) > 800:
+    elif word_count > 800:
         return "Too long"
     else:
         return "Could be more readable"
 
 def count_action_verbs(content):
     # Simple action verb counter (can be enhanced with a comprehensive list)
-    action_verbs = ["developed", "created", "managed", "led", "implemented", "designed", 
-                   "coordinated", "achieved", "improved", "reduced", "increased", "generated"]
-    count = 0
-    for verb in action_verbs:
-        count += content.lower().count(f" {verb} ")
-    return count
+    return get_resume_metrics(content).action_verb_count
 
 def identify_strengths(content, target_job):
     # Identify strengths based on content and target job
+    metrics = get_resume_metrics(content)
     strengths = []
     
     # Technical skills check
-    tech_skills = ["python", "java", "javascript", "react", "node", "sql", "aws", "docker"]
-    for skill in tech_skills:
-        if skill in content.lower() and skill in target_job.lower():
+    target_job = (target_job or '').lower()
+    for skill in TECH_SKILLS:
+        if skill in metrics.phrases and skill in target_job:
             strengths.append(f"Matching {skill.upper()} skills")
     
     # Experience check
-    experience_indicators = ["years of experience", "led team", "managed project"]
-    for indicator in experience_indicators:
-        if indicator in content.lower():
-            strengths.append("Demonstrated leadership experience")
-            break
+    if any(indicator in metrics.phrases for indicator in EXPERIENCE_INDICATORS):
+        strengths.append("Demonstrated leadership experience")
     
     # If no strengths found
     if not strengths:
@@ -735,23 +2775,24 @@ def identify_strengths(content, target_job):
 
 def identify_improvements(content, target_job):
     # Identify areas for improvement
+    metrics = get_resume_metrics(content)
     improvements = []
     
     # Length check
-    word_count = len(content.split())
+    word_count = metrics.word_count
     if word_count < 300:
         improvements.append("Resume is too short - add more relevant details")
     elif word_count > 700:
         improvements.append("Resume is too long - consider condensing")
     
     # Action verbs check
-    if count_action_verbs(content) < 8:
+    if metrics.action_verb_count < 8:
         improvements.append("Use more action verbs to strengthen impact")
     
     # Keywords check
     if target_job:
         job_keywords = extract_keywords(target_job)
-        missing_keywords = [k for k in job_keywords if k not in content.lower()]
+        missing_keywords = [k for k in job_keywords if k not in metrics.phrases]
         if missing_keywords:
             improvements.append(f"Missing key terms: {', '.join(missing_keywords[:3])}")
     
@@ -763,9 +2804,8 @@ def identify_improvements(content, target_job):
 
 def extract_keywords(text):
     # Simple keyword extractor (can be enhanced with NLP)
-    common_keywords = ["python", "java", "javascript", "agile", "scrum", "leadership", 
-                      "development", "software", "engineering", "team", "project"]
-    return [word for word in common_keywords if word in text.lower()]
+    phrases = get_resume_metrics(text).phrases
+    return [word for word in COMMON_KEYWORDS if word in phrases]
 
 def generate_section_feedback(sections):
     feedback = {}
@@ -846,10 +2886,11 @@ def analyze_skills_section(content):
 
 def generate_recommendations(content, target_job):
     # Generate recommendations
+    metrics = get_resume_metrics(content)
     recommendations = []
     
     # Length recommendations
-    word_count = len(content.split())
+    word_count = metrics.word_count
     if word_count < 350:
         recommendations.append("Expand your resume with more detailed achievements and responsibilities")
     elif word_count > 700:
@@ -859,35 +2900,36 @@ def generate_recommendations(content, target_job):
     recommendations.append("Customize your resume keywords to match the specific job description")
     
     # Action verbs
-    if count_action_verbs(content) < 10:
+    if metrics.action_verb_count < 10:
         recommendations.append("Strengthen impact by using more action verbs like 'developed', 'implemented', and 'achieved'")
     
     # Quantifiable achievements
-    if not any(char.isdigit() for char in content):
+    if metrics.digit_count == 0:
         recommendations.append("Add quantifiable achievements (e.g., 'increased efficiency by 20%')")
     
     # Missing sections check
-    if "education" not in content.lower():
+    if "education" not in metrics.phrases:
         recommendations.append("Add an Education section with your degrees and relevant coursework")
     
-    if "skills" not in content.lower():
+    if "skills" not in metrics.phrases:
         recommendations.append("Include a dedicated Skills section highlighting technical and soft skills")
     
     return recommendations
 
 def score_resume(content, target_job):
     # Calculate an overall score
+    metrics = get_resume_metrics(content)
     score = 61  # Base score
     
     # Length adjustment
-    word_count = len(content.split())
+    word_count = metrics.word_count
     if 350 <= word_count <= 700:
         score += 10
     elif word_count < 200 or word_count > 1000:
         score -= 10
     
     # Action verbs adjustment
-    action_verb_count = count_action_verbs(content)
+    action_verb_count = metrics.action_verb_count
     if action_verb_count >= 10:
         score += 5
     elif action_verb_count <= 5:
@@ -896,50 +2938,337 @@ def score_resume(content, target_job):
     # Keywords adjustment
     if target_job:
         keywords = extract_keywords(target_job)
-        matching_keywords = sum(1 for k in keywords if k in content.lower())
+        matching_keywords = sum(1 for k in keywords if k in metrics.phrases)
         score += min(matching_keywords * 3, 15)
     
     # Quantifiable achievements
-    if sum(c.isdigit() for c in content) > 5:
+    if metrics.digit_count > 5:
         score += 5
     
     # Bullet points
-    if content.count('•') >= 10:
+    if metrics.bullet_count >= 10:
         score += 5
-    elif content.count('•') <= 3:
+    elif metrics.bullet_count <= 3:
         score -= 5
     
     # Cap the score
     return max(0, min(score, 100))
 
-def optimize_for_ats(content, job_description):
-    # Simple ATS optimization suggestions
-    suggestions = []
-    
-    # Extract keywords from job description
-    job_keywords = extract_keywords(job_description)
-    job_keywords.extend([
-        "experience", "teamwork", "communication", "leadership", 
-        "project management", "software development", "problem-solving"
-    ])
+# Job description matching
+MATCH_CORPUS_TTL = float(os.environ.get('MATCH_CORPUS_TTL', 600))
+MATCH_TERM_LIMIT = int(os.environ.get('MATCH_TERM_LIMIT', 200))
+
+# Words like "c++", "c#", "node.js", "ci/cd" and "front-end" stay whole
+MATCH_TERM_RE = re.compile(r"[a-z][a-z0-9]*(?:[+#]+|(?:[./-][a-z0-9]+)+)?")
+# Punctuation that ends a phrase; a period only counts at the end of a sentence
+MATCH_BREAK_RE = re.compile(r"[,;:!?()\[\]{}<>\n\r\t•|*]|\.(?=\s|$)")
+MATCH_SHORT_TERMS = frozenset(("c", "r", "go"))
+MATCH_STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below between both
+but by can could did do does doing down during each etc few for from further had has have having he her here hers
+him his how i if in including into is it its just may me more most must my no nor not of off on once only or other
+our ours out over own per same she should so some such than that the their theirs them then there these they this
+those through to too under until up upon very via was we well were what when where which while who whom why will
+with within would you your yours
+ability able candidate candidates duties experience experienced familiarity ideal job join knowledge looking
+preferred plus position proficiency qualifications required requirements responsibilities role skills strong
+understanding work working years year
+""".split())
+
+def count_terms(text):
+    """Frequencies of the words and two-word phrases in a text, ignoring stopwords"""
+    counts = Counter()
+    for chunk in MATCH_BREAK_RE.split(text.lower()):
+        # Stopwords become None so they still break phrases
+        tokens = [
+            None if token in MATCH_STOPWORDS or (len(token) < 2 and token not in MATCH_SHORT_TERMS) else token
+            for token in MATCH_TERM_RE.findall(chunk)
+        ]
+        counts.update(filter(None, tokens))
+        counts.update(f'{previous} {token}' for previous, token in zip(tokens, tokens[1:]) if previous and token)
+    return counts
+
+@lru_cache(maxsize=1024)
+def get_terms(text):
+    return count_terms(text)
+
+class MatchCorpus:
+    """Document frequencies over stored resumes and job descriptions.
     
-    # Find missing keywords
-    missing_keywords = [k for k in job_keywords if k not in content.lower()]
+    Writers keep match_doc_freq current as documents change (see index_match_document), so loading
+    is one table read. This process's own changes apply at once; other processes' changes arrive with
+    the reload every MATCH_CORPUS_TTL seconds, which runs in the background while the old copy serves.
+    """
     
-    if missing_keywords:
-        suggestions.append(f"Add these keywords to improve ATS match: {', '.join(missing_keywords[:5])}")
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # (document count, term document frequencies), replaced as a pair on reload
+        self.frequencies = (0, Counter())
+        self.loaded_at = 0
+        self.reloading = False
     
-    suggestions.append("Use standard section headings (Experience, Education, Skills)")
-    suggestions.append("Remove graphics, tables, and special characters that ATS might not parse correctly")
+    @property
+    def doc_count(self):
+        return self.frequencies[0]
     
-    return suggestions
+    def load(self, conn):
+        # Plain tuples; building a Row per term would dominate the load
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        doc_freq = Counter(dict(cursor.execute('SELECT term, doc_count FROM match_doc_freq').fetchall()))
+        doc_count = conn.execute('SELECT COUNT(*) FROM match_terms').fetchone()[0]
+        self.frequencies = (doc_count, doc_freq)
+        self.loaded_at = time.time()
+    
+    def reload(self):
+        conn = get_db_connection()
+        try:
+            self.load(conn)
+        except Exception:
+            app.logger.exception("Could not reload the job matching corpus")
+        finally:
+            conn.close()
+            self.reloading = False
+    
+    def refresh(self, conn=None):
+        if not self.loaded_at:
+            # Nothing to serve yet, so the first load is the only one a request waits for
+            with self.lock:
+                if not self.loaded_at:
+                    self.load(conn or get_db())
+        elif time.time() - self.loaded_at > self.ttl and not self.reloading:
+            with self.lock:
+                if not self.reloading:
+                    self.reloading = True
+                    threading.Thread(target=self.reload, name='match-corpus-reload', daemon=True).start()
+        return self
+    
+    def update(self, added, removed, new_documents):
+        """Apply one document's term changes to the loaded frequencies"""
+        with self.lock:
+            doc_count, doc_freq = self.frequencies
+            doc_freq.update(added)
+            doc_freq.subtract(removed)
+            self.frequencies = (doc_count + new_documents, doc_freq)
+    
+    def idf(self, terms):
+        """Smoothed inverse document frequency for each term"""
+        doc_count, doc_freq = self.frequencies
+        doc_freq = np.fromiter(map(doc_freq.get, terms, repeat(0)), dtype=float, count=len(terms))
+        return np.log((1 + doc_count) / (1 + doc_freq)) + 1
+    
+    def invalidate(self):
+        self.loaded_at = 0
 
-def check_grammar_formatting(content):
-    # Simple grammar and formatting checks
-    issues = []
+match_corpus = MatchCorpus(MATCH_CORPUS_TTL)
+
+def index_match_document(conn, document, content):
+    """Store a document's term set and shift match_doc_freq by what changed; the caller commits"""
+    content_hash = hashlib.sha1(content.encode('utf-8')).hexdigest()
+    row = conn.execute('SELECT content_hash, terms FROM match_terms WHERE document = ?', (document,)).fetchone()
+    if row and row[0] == content_hash:
+        return
+    
+    old_terms = set(json.loads(row[1])) if row else set()
+    new_terms = set(count_terms(content))
+    added = new_terms - old_terms
+    removed = old_terms - new_terms
+    conn.executemany(
+        'INSERT INTO match_doc_freq (term, doc_count) VALUES (?, 1) '
+        'ON CONFLICT (term) DO UPDATE SET doc_count = doc_count + 1',
+        ((term,) for term in added)
+    )
+    conn.executemany('UPDATE match_doc_freq SET doc_count = doc_count - 1 WHERE term = ?', ((term,) for term in removed))
+    conn.executemany('DELETE FROM match_doc_freq WHERE term = ? AND doc_count <= 0', ((term,) for term in removed))
+    conn.execute(
+        'INSERT OR REPLACE INTO match_terms (document, content_hash, terms) VALUES (?, ?, ?)',
+        (document, content_hash, json.dumps(sorted(new_terms)))
+    )
+    match_corpus.update(added, removed, 0 if row else 1)
+
+def build_match_index(conn, chunk_size=1000):
+    """Index every stored resume and job description from scratch; the caller commits"""
+    conn.execute('DELETE FROM match_terms')
+    conn.execute('DELETE FROM match_doc_freq')
+    doc_freq = Counter()
+    cursor = conn.execute(
+        "SELECT 'resume:' || id, content FROM resumes UNION ALL SELECT 'job:' || id, content FROM job_descriptions"
+    )
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        indexed = []
+        for document, content in rows:
+            terms = sorted(count_terms(content))
+            doc_freq.update(terms)
+            indexed.append((document, hashlib.sha1(content.encode('utf-8')).hexdigest(), json.dumps(terms)))
+        conn.executemany('INSERT INTO match_terms (document, content_hash, terms) VALUES (?, ?, ?)', indexed)
+    conn.executemany('INSERT INTO match_doc_freq (term, doc_count) VALUES (?, ?)', doc_freq.items())
+
+def weigh_terms(counts, corpus):
+    """L2-normalized sublinear tf-idf weights for a term count mapping, as (terms, weights)"""
+    terms = list(counts)
+    if not terms:
+        return terms, np.zeros(0)
+    tf = np.fromiter(counts.values(), dtype=float, count=len(terms))
+    weights = (1 + np.log(tf)) * corpus.idf(terms)
+    return terms, weights / np.linalg.norm(weights)
+
+class JobMatcher:
+    """A job description's tf-idf vector, scored against batches of resumes through an inverted index"""
     
-    # Check for common grammar issues
-    grammar_checks = {
+    def __init__(self, job_description, corpus=None):
+        self.corpus = corpus or match_corpus.refresh()
+        terms, weights = weigh_terms(get_terms(job_description), self.corpus)
+        
+        # Keep the heaviest terms; the tail adds little to the score
+        order = np.argsort(-weights, kind='stable')[:MATCH_TERM_LIMIT]
+        self.terms = [terms[i] for i in order]
+        self.weights = weights[order]
+        self.term_index = {term: i for i, term in enumerate(self.terms)}
+    
+    def keywords(self, limit=20):
+        return self.terms[:limit]
+    
+    def score_batch(self, texts, counts=None):
+        """Cosine similarity and weighted keyword coverage for a batch of texts, computed with array operations.
+
+        Also returns the postings (text row, job term column) of every job term found in a text.
+        """
+        # Flatten every text's term counts into parallel arrays tagged with the text's row
+        rows, terms, tfs = [], [], []
+        for row, text_counts in enumerate(counts or (count_terms(text) for text in texts)):
+            rows.extend([row] * len(text_counts))
+            terms.extend(text_counts)
+            tfs.extend(text_counts.values())
+        
+        size = len(texts)
+        rows = np.array(rows, dtype=np.int64)
+        weights = (1 + np.log(np.array(tfs, dtype=float))) * self.corpus.idf(terms)
+        norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=size))
+        
+        # Inverted index lookup: keep only the entries for terms that are in the job description
+        cols = np.fromiter(map(self.term_index.get, terms, repeat(-1)), dtype=np.int64, count=len(terms))
+        hits = cols >= 0
+        rows, cols, weights = rows[hits], cols[hits], weights[hits]
+        
+        dot = np.bincount(rows, weights=weights * self.weights[cols], minlength=size)
+        scores = dot / np.where(norms > 0, norms, 1)
+        coverage = np.bincount(rows, weights=self.weights[cols], minlength=size) / (self.weights.sum() or 1.0)
+        return scores, coverage, rows, cols
+    
+    def score(self, texts, detail_limit=10):
+        """Score each text against the job description, with matched and missing terms by weight"""
+        scores, coverage, rows, cols = self.score_batch(texts, [get_terms(text) for text in texts])
+        
+        matched = [set() for _ in texts]
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            matched[row].add(col)
+        
+        results = []
+        for row in range(len(texts)):
+            # Job terms are sorted by weight, so column order is rank order
+            found = sorted(matched[row])
+            missing = [col for col in range(len(self.terms)) if col not in matched[row]]
+            results.append({
+                'score': round(float(scores[row]) * 100, 1),
+                'keyword_coverage': round(float(coverage[row]) * 100, 1),
+                'matched_terms': [self.terms[col] for col in found[:detail_limit]],
+                'missing_terms': [self.terms[col] for col in missing[:detail_limit]],
+            })
+        return results
+
+RANK_TOP_K = int(os.environ.get('RANK_TOP_K', 20))
+RANK_MAX_TOP_K = int(os.environ.get('RANK_MAX_TOP_K', 500))
+RANK_CHUNK_SIZE = int(os.environ.get('RANK_CHUNK_SIZE', 1000))
+
+def rank_resumes(conn, job_description, top_k=RANK_TOP_K, chunk_size=RANK_CHUNK_SIZE, user_id=None, corpus=None):
+    """Stream stored resumes in chunks and keep the top_k best matches for a job description.
+    
+    top_k=None keeps every resume. Returns the ranking with a breakdown per resume and the throughput.
+    """
+    start = time.perf_counter()
+    matcher = JobMatcher(job_description, corpus)
+    
+    sql = 'SELECT id, user_id, title, target_job, score, content FROM resumes'
+    params = ()
+    if user_id is not None:
+        sql += ' WHERE user_id = ?'
+        params = (user_id,)
+    cursor = conn.execute(sql, params)
+    
+    # Min-heap of (score, -resume id, row) holding the best matches so far
+    best = []
+    scored = 0
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        scores = matcher.score_batch([row['content'] for row in rows])[0]
+        scored += len(rows)
+        
+        # Only the chunk's own top_k can make it into the overall top_k
+        if top_k is None or len(rows) <= top_k:
+            candidates = range(len(rows))
+        else:
+            candidates = np.argpartition(-scores, top_k)[:top_k].tolist()
+        for index in candidates:
+            entry = (float(scores[index]), -rows[index]['id'], rows[index])
+            if top_k is None or len(best) < top_k:
+                heapq.heappush(best, entry)
+            elif entry[:2] > best[0][:2]:
+                heapq.heapreplace(best, entry)
+    
+    # Breakdowns are only worked out for the resumes that made the cut
+    winners = [row for _, _, row in sorted(best, key=lambda entry: entry[:2], reverse=True)]
+    details = matcher.score([row['content'] for row in winners])
+    elapsed = time.perf_counter() - start
+    
+    return {
+        'keywords': matcher.keywords(),
+        'results': [
+            dict(detail, resume_id=row['id'], user_id=row['user_id'], title=row['title'],
+                 target_job=row['target_job'], resume_score=row['score'])
+            for row, detail in zip(winners, details)
+        ],
+        'scored': scored,
+        'elapsed': round(elapsed, 3),
+        'resumes_per_sec': round(scored / elapsed, 1) if elapsed else 0.0,
+    }
+
+def save_job_description(conn, user_id, job_description):
+    """Add a job description to the matching corpus; the caller commits"""
+    content_hash = hashlib.sha1(job_description.encode('utf-8')).hexdigest()
+    cursor = conn.execute(
+        'INSERT OR IGNORE INTO job_descriptions (user_id, content, content_hash) VALUES (?, ?, ?)',
+        (user_id, job_description, content_hash)
+    )
+    if cursor.rowcount:
+        index_match_document(conn, f'job:{cursor.lastrowid}', job_description)
+
+def optimize_for_ats(content, job_description):
+    # ATS suggestions from the job description's weighted terms
+    match = JobMatcher(job_description).score([content])[0]
+    suggestions = [f"Keyword match with the job description: {match['score']}% "
+                   f"({match['keyword_coverage']}% of its weighted keywords)"]
+    
+    if match['missing_terms']:
+        suggestions.append(f"Add these keywords to improve ATS match: {', '.join(match['missing_terms'][:5])}")
+    
+    suggestions.append("Use standard section headings (Experience, Education, Skills)")
+    suggestions.append("Remove graphics, tables, and special characters that ATS might not parse correctly")
+    
+    return suggestions
+
+def check_grammar_formatting(content):
+    # Simple grammar and formatting checks
+    metrics = get_resume_metrics(content)
+    issues = []
+    
+    # Check for common grammar issues
+    grammar_checks = {
         "i ": "Capitalize 'I'",
         "  ": "Remove double spaces",
         "!": "Avoid exclamation marks in professional documents",
@@ -951,17 +3280,11 @@ def check_grammar_formatting(content):
             issues.append(suggestion)
     
     # Check for inconsistent spacing
-    if re.search(r'\n\n\n', content):
+    if '\n\n\n' in content:
         issues.append("Avoid excessive blank lines")
     
     # Check for consistent tense
-    past_tense = ["developed", "created", "managed", "led"]
-    present_tense = ["develop", "create", "manage", "lead"]
-    
-    past_count = sum(content.lower().count(word) for word in past_tense)
-    present_count = sum(content.lower().count(word) for word in present_tense)
-    
-    if past_count > 0 and present_count > 0:
+    if metrics.past_tense_count > 0 and metrics.present_tense_count > 0:
         issues.append("Use consistent verb tense throughout your resume")
     
     if not issues:
@@ -969,10 +3292,360 @@ def check_grammar_formatting(content):
     
     return issues
 
+# Resume export rendering
+PDF_RENDERER = os.environ.get('PDF_RENDERER', 'auto')
+WKHTMLTOPDF_PATH = os.environ.get('WKHTMLTOPDF_PATH')
+
+def parse_personal_info(sections):
+    """Pull the name and contact line out of the Personal Information section"""
+    personal_info = ""
+    for section in sections:
+        if section['section_name'] == 'Personal Information':
+            personal_info = section['content']
+            break
+    
+    # Parse name and contact from personal info (simple implementation)
+    name = "John Doe"  # Default
+    contact = "email@example.com • (555) 123-4567"  # Default
+    
+    lines = personal_info.split('\n')
+    if lines and lines[0].strip():
+        name = lines[0].strip()
+    if len(lines) > 1:
+        contact = ' • '.join(line.strip() for line in lines[1:3] if line.strip())
+    
+    return name, contact
+
+# Compiled resume templates
+TEMPLATE_CACHE_TTL = float(os.environ.get('TEMPLATE_CACHE_TTL', 30))
+TEMPLATE_PLACEHOLDER_RE = re.compile(r'\{(name|contact|sections)\}')
+
+# Autoescaping environment for resume documents, separate from the app's page templates
+resume_template_env = Environment(autoescape=True)
+
+RESUME_PAGE_HEAD = """
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="UTF-8">
+        <title>{{ title }}</title>
+        <style>
+            {% raw %}__CSS__{% endraw %}
+            @page { size: letter; margin: 0.75in; }
+            body { margin: 0; padding: 0; }
+        </style>
+    </head>
+    <body>
+        """
+
+RESUME_PAGE_FOOT = """
+    </body>
+    </html>
+    """
+
+class CompiledTemplate:
+    """A templates row compiled into a Jinja render function"""
+    
+    def __init__(self, row):
+        self.id = row['id']
+        self.name = row['name']
+        self.description = row['description']
+        self.fingerprint = self.make_fingerprint(row)
+        
+        # html_structure and css_content are template markup, so they are kept verbatim;
+        # only the {name}, {contact} and {sections} placeholders become escaped expressions
+        parts = [RESUME_PAGE_HEAD.replace('__CSS__', row['css_content'] or '')]
+        for index, chunk in enumerate(TEMPLATE_PLACEHOLDER_RE.split(row['html_structure'] or '')):
+            if index % 2:
+                parts.append('{{ %s }}' % chunk)
+            elif chunk:
+                parts.append('{% raw %}' + chunk + '{% endraw %}')
+        parts.append(RESUME_PAGE_FOOT)
+        self.template = resume_template_env.from_string(''.join(parts))
+    
+    @staticmethod
+    def make_fingerprint(row):
+        material = f"{row['css_content']}\0{row['html_structure']}"
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()[:16]
+    
+    def render(self, title, name, contact, sections_html):
+        return self.template.render(title=title, name=name, contact=contact, sections=sections_html)
+
+class TemplateCache:
+    """Compiled templates rows, reloaded every TEMPLATE_CACHE_TTL seconds and recompiled only when a row changes"""
+    
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.compiled = {}
+        self.loaded_at = 0
+    
+    def load(self):
+        rows = get_db().execute('SELECT * FROM templates ORDER BY id').fetchall()
+        compiled = {}
+        for row in rows:
+            current = self.compiled.get(row['id'])
+            if current and current.fingerprint == CompiledTemplate.make_fingerprint(row):
+                compiled[row['id']] = current
+            else:
+                compiled[row['id']] = CompiledTemplate(row)
+        self.compiled = compiled
+        self.loaded_at = time.time()
+    
+    def refresh(self):
+        if time.time() - self.loaded_at > self.ttl:
+            with self.lock:
+                if time.time() - self.loaded_at > self.ttl:
+                    self.load()
+    
+    def get(self, template_id):
+        self.refresh()
+        try:
+            return self.compiled.get(int(template_id))
+        except (TypeError, ValueError):
+            return None
+    
+    def all(self):
+        self.refresh()
+        return list(self.compiled.values())
+    
+    def invalidate(self):
+        """Force a reload on next use; call after writing to the templates table"""
+        self.loaded_at = 0
+
+resume_templates = TemplateCache(TEMPLATE_CACHE_TTL)
+
+def build_sections_html(sections):
+    """Escaped section markup for every non-empty section"""
+    return Markup(''.join(
+        f"<div class='section'><h2>{escape(section['section_name'])}</h2><div>{escape(section['content'])}</div></div>"
+        for section in sections if section['content'].strip()
+    ))
+
+def build_resume_html(resume, sections, template):
+    """Render a resume through a compiled template"""
+    name, contact = parse_personal_info(sections)
+    return template.render(resume['title'], name, contact, build_sections_html(sections))
+
+def build_resume_docx(name, contact, sections):
+    """Build a Word document for the resume and return its bytes"""
+    doc = Document()
+    
+    # Add name as title
+    doc.add_heading(name, 0)
+    
+    # Add contact info
+    doc.add_paragraph(contact)
+    
+    # Add sections
+    for section in sections:
+        if section['content'].strip():
+            doc.add_heading(section['section_name'], 1)
+            doc.add_paragraph(section['content'])
+    
+    # Save to BytesIO
+    file_stream = BytesIO()
+    doc.save(file_stream)
+    return file_stream.getvalue()
+
+def render_pdf_weasyprint(html):
+    from weasyprint import HTML
+    return HTML(string=html).write_pdf()
+
+def render_pdf_xhtml2pdf(html):
+    from xhtml2pdf import pisa
+    output = BytesIO()
+    result = pisa.CreatePDF(html, dest=output, encoding='utf-8')
+    if result.err:
+        raise Exception(f"xhtml2pdf reported {result.err} error(s)")
+    return output.getvalue()
+
+def render_pdf_pdfkit(html):
+    import pdfkit
+    configuration = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH) if WKHTMLTOPDF_PATH else None
+    # output_path=False returns the PDF bytes instead of writing a file
+    return pdfkit.from_string(html, False, configuration=configuration, options={'quiet': '', 'encoding': 'UTF-8'})
+
+# Renderers in order of preference for PDF_RENDERER=auto
+PDF_RENDERERS = {
+    'weasyprint': render_pdf_weasyprint,
+    'xhtml2pdf': render_pdf_xhtml2pdf,
+    'pdfkit': render_pdf_pdfkit,
+}
+
+@lru_cache(maxsize=None)
+def get_pdf_renderer(name=None):
+    """Resolve the configured PDF renderer, probing each one in order when set to auto"""
+    name = name or PDF_RENDERER
+    if name != 'auto':
+        if name not in PDF_RENDERERS:
+            raise Exception(f"Unknown PDF renderer '{name}', choose from: {', '.join(PDF_RENDERERS)}")
+        return name, PDF_RENDERERS[name]
+    
+    for candidate, renderer in PDF_RENDERERS.items():
+        try:
+            renderer('<p>probe</p>')
+        except Exception:
+            continue
+        return candidate, renderer
+    raise Exception("No PDF renderer is available; install weasyprint, xhtml2pdf or wkhtmltopdf")
+
+def render_pdf(html, renderer=None):
+    """Render an HTML document to PDF bytes in memory"""
+    _, render = get_pdf_renderer(renderer)
+    return render(html)
+
+# Rendered export cache configuration
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', 'export_cache')
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# Eviction frees space down to this fraction of the limit, so it runs once per batch of writes
+EXPORT_CACHE_LOW_WATER = float(os.environ.get('EXPORT_CACHE_LOW_WATER', 0.8))
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', 4))
+EXPORT_BULK_MAX = int(os.environ.get('EXPORT_BULK_MAX', 500))
+
+EXPORT_MIMETYPES = {
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'html': 'text/html; charset=utf-8',
+}
+
+class ExportCache:
+    """On-disk cache of rendered exports keyed on resume revision, template and format, with LRU eviction.
+    
+    The total size is tracked in memory and only resynced from disk when an eviction scans the
+    directory, so files other processes wrote since the last scan are counted at the next one.
+    """
+    
+    def __init__(self, directory, max_bytes, low_water=EXPORT_CACHE_LOW_WATER):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self.lock = threading.Lock()
+        self.total = None
+        os.makedirs(directory, exist_ok=True)
+    
+    @staticmethod
+    def make_key(resume_id, revision, template_id, format_type):
+        material = f'{resume_id}:{revision}:{template_id}:{format_type}'
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()[:32]
+    
+    def path_for(self, resume_id, key):
+        # One directory per resume so every revision of a resume can be dropped at once
+        return os.path.join(self.directory, str(resume_id), key)
+    
+    def get(self, resume_id, key):
+        path = self.path_for(resume_id, key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # The modification time doubles as the last-used time for LRU eviction
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+    
+    def set(self, resume_id, key, data):
+        path = self.path_for(resume_id, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        # Write under a temporary name first so readers never see a partial file
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        
+        with self.lock:
+            if self.total is None:
+                self.total = sum(size for _, size, _ in self.scan())
+            else:
+                self.total += len(data) - replaced
+            over = self.total > self.max_bytes
+        if over:
+            self.evict()
+    
+    def invalidate(self, resume_id):
+        freed = 0
+        try:
+            entries = list(os.scandir(os.path.join(self.directory, str(resume_id))))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            freed += size
+        with self.lock:
+            if self.total is not None:
+                self.total -= freed
+    
+    def scan(self):
+        """(last used, size, path) for every cached file"""
+        entries = []
+        directories = [self.directory]
+        while directories:
+            try:
+                listing = list(os.scandir(directories.pop()))
+            except OSError:
+                continue
+            for entry in listing:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+    
+    def evict(self):
+        """Remove least recently used files until the cache is down to low_water of max_bytes"""
+        with self.lock:
+            entries = self.scan()
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * self.low_water
+            
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+            self.total = total
+
+export_cache = ExportCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES)
+
+def render_export(resume, template, format_type):
+    """Render a resume export, reusing the cached artifact for this revision when there is one"""
+    # The fingerprint keeps artifacts rendered from an older version of the template out of reach
+    key = ExportCache.make_key(resume['id'], resume['revision'], f'{template.id}:{template.fingerprint}', format_type)
+    artifact = export_cache.get(resume['id'], key)
+    
+    if artifact is None:
+        sections = get_db().execute('SELECT * FROM resume_sections WHERE resume_id = ? ORDER BY position', (resume['id'],)).fetchall()
+        
+        if format_type == 'docx':
+            name, contact = parse_personal_info(sections)
+            artifact = build_resume_docx(name, contact, sections)
+        else:
+            full_html = build_resume_html(resume, sections, template)
+            artifact = render_pdf(full_html) if format_type == 'pdf' else full_html.encode('utf-8')
+        
+        export_cache.set(resume['id'], key, artifact)
+    
+    return artifact, key
+
 @app.route('/resume/<int:resume_id>/export', methods=['GET', 'POST'])
 @login_required
 def export_resume(resume_id):
-    conn = get_db_connection()
+    conn = get_db()
     cursor = conn.cursor()
     
     # Get resume
@@ -980,18 +3653,9 @@ def export_resume(resume_id):
     resume = cursor.fetchone()
     
     if not resume:
-        conn.close()
         flash('Resume not found or access denied')
         return redirect(url_for('dashboard'))
     
-    # Get sections
-    cursor.execute('SELECT * FROM resume_sections WHERE resume_id = ?', (resume_id,))
-    sections = cursor.fetchall()
-    
-    # Get templates
-    cursor.execute('SELECT * FROM templates')
-    templates = cursor.fetchall()
-    
     # Check if this is a GET request with format_type parameter (for iframe direct loading)
     is_preview = False
     format_type = None
@@ -999,198 +3663,254 @@ def export_resume(resume_id):
     
     if request.method == 'GET' and 'format_type' in request.args:
         format_type = request.args.get('format_type')
-        template_id = request.args.get('template_id', 1)
+        template_id = request.args.get('template_id', 1, type=int)
         is_preview = request.args.get('preview', 'false') == 'true'
     
     if request.method == 'POST' or format_type:
         if not format_type:  # If not set from GET params
             format_type = request.form['format_type']
-            template_id = request.form.get('template_id', 1)
+            template_id = request.form.get('template_id', 1, type=int)
             is_preview = request.form.get('preview', 'false') == 'true'
         
+        # Anything other than a file format falls back to the HTML preview
+        if format_type not in EXPORT_MIMETYPES:
+            format_type = 'html'
+        
         # Get selected template
-        cursor.execute('SELECT * FROM templates WHERE id = ?', (template_id,))
-        template = cursor.fetchone()
-        
-        # Prepare content
-        content = ""
-        for section in sections:
-            if section['content'].strip():
-                content += f"<div class='section'><h2>{section['section_name']}</h2><div>{section['content']}</div></div>"
-        
-        # Extract personal info for header
-        personal_info = ""
-        for section in sections:
-            if section['section_name'] == 'Personal Information':
-                personal_info = section['content']
-                break
+        template = resume_templates.get(template_id)
         
-        # Parse name and contact from personal info (simple implementation)
-        name = "John Doe"  # Default
-        contact = "email@example.com • (555) 123-4567"  # Default
-        
-        lines = personal_info.split('\n')
-        if lines and lines[0].strip():
-            name = lines[0].strip()
-        if len(lines) > 1:
-            contact = ' • '.join(line.strip() for line in lines[1:3] if line.strip())
-        
-        # Format HTML based on template
-        html_structure = template['html_structure']
-        html_content = html_structure.replace('{name}', name).replace('{contact}', contact).replace('{sections}', content)
-        
-        # Add template CSS
-        css = template['css_content']
-        full_html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>{resume['title']}</title>
-            <style>
-                {css}
-                @page {{ size: letter; margin: 0.75in; }}
-                body {{ margin: 0; padding: 0; }}
-            </style>
-        </head>
-        <body>
-            {html_content}
-        </body>
-        </html>
-        """
+        if not template:
+            flash('Template not found')
+            return redirect(url_for('export_resume', resume_id=resume_id))
         
-        if format_type == 'pdf':
-            try:
-                # Import required modules here to ensure COM initialization happens correctly
-                import pythoncom
-                
-                # Initialize COM for this thread - this fixes the CoInitialize error
-                pythoncom.CoInitialize()
-                
-                try:
-                    # Create a new Document
-                    doc = Document()
-                    
-                    # Add name as title
-                    doc.add_heading(name, 0)
-                    
-                    # Add contact info
-                    doc.add_paragraph(contact)
-                    
-                    # Add sections
-                    for section in sections:
-                        if section['content'].strip():
-                            doc.add_heading(section['section_name'], 1)
-                            doc.add_paragraph(section['content'])
-                    
-                    # Create temporary files for the conversion process
-                    with tempfile.TemporaryDirectory() as temp_dir:
-                        # Create temporary file paths
-                        docx_path = os.path.join(temp_dir, f"{resume['title']}.docx")
-                        pdf_path = os.path.join(temp_dir, f"{resume['title']}.pdf")
-                        
-                        # Save the DOCX to the temporary location
-                        doc.save(docx_path)
-                        
-                        # Convert DOCX to PDF
-                        convert(docx_path, pdf_path)
-                        
-                        # Read the PDF file
-                        with open(pdf_path, 'rb') as pdf_file:
-                            pdf_content = pdf_file.read()
-                        
-                        # Return the PDF file as a response
-                        response = make_response(pdf_content)
-                        response.headers['Content-Type'] = 'application/pdf'
-                        
-                        # Set Content-Disposition based on whether this is a preview or download
-                        if is_preview:
-                            # For preview, use 'inline' to display in browser
-                            response.headers['Content-Disposition'] = f'inline; filename={resume["title"]}.pdf'
-                        else:
-                            # For download, use 'attachment' to prompt download
-                            response.headers['Content-Disposition'] = f'attachment; filename={resume["title"]}.pdf'
-                        
-                        conn.close()
-                        return response
-                finally:
-                    # Always uninitialize COM when done, even if an exception occurred
-                    pythoncom.CoUninitialize()
-                        
-            except Exception as e:
-                flash(f'Error generating PDF: {str(e)}')
-                conn.close()
-                return redirect(url_for('export_resume', resume_id=resume_id))
-                        
-        elif format_type == 'docx':
+        try:
+            artifact, etag = render_export(resume, template, format_type)
+        except Exception as e:
+            flash(f'Error generating {format_type.upper()}: {str(e)}')
+            return redirect(url_for('export_resume', resume_id=resume_id))
+        
+        response = make_response(artifact)
+        response.headers['Content-Type'] = EXPORT_MIMETYPES[format_type]
+        
+        disposition = None
+        if format_type != 'html':
+            # Use 'inline' so PDF previews display in the browser, 'attachment' to prompt download
+            disposition = 'inline' if is_preview and format_type == 'pdf' else 'attachment'
+            response.headers['Content-Disposition'] = f'{disposition}; filename={resume["title"]}.{format_type}'
+        
+        # Let browsers revalidate with a 304 instead of downloading the same revision again;
+        # the disposition is part of the tag so a cached preview never answers for a download
+        response.set_etag(f'{etag}-{disposition}' if disposition else etag)
+        response.last_modified = datetime.strptime(resume['updated_at'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+    
+    # If we get here, it's a GET request without format_type, so show the export options page
+    return render_template('export_resume.html', resume=resume, templates=resume_templates.all())
+
+class ZipStream:
+    """Write-only file object that buffers zip output until the response generator drains it"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def render_export_in_context(resume, template, format_type):
+    # Worker threads need their own app context for get_db()
+    with app.app_context():
+        return render_export(resume, template, format_type)[0]
+
+def stream_bulk_export(resumes, template, format_type):
+    """Render resumes on the worker pool and yield a zip archive as each file completes"""
+    output = ZipStream()
+    # PDF and DOCX are already compressed, so only deflate HTML
+    compression = zipfile.ZIP_DEFLATED if format_type == 'html' else zipfile.ZIP_STORED
+    errors = []
+    
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as executor, \
+            zipfile.ZipFile(output, mode='w', compression=compression) as archive:
+        # Keep only a small window of renders in flight so memory stays flat however large the batch
+        window = deque()
+        pending = iter(resumes)
+        for resume in pending:
+            window.append((resume, executor.submit(render_export_in_context, resume, template, format_type)))
+            if len(window) >= EXPORT_WORKERS * 2:
+                break
+        
+        while window:
+            resume, future = window.popleft()
+            next_resume = next(pending, None)
+            if next_resume is not None:
+                window.append((next_resume, executor.submit(render_export_in_context, next_resume, template, format_type)))
+            
+            filename = f"{resume['id']}-{secure_filename(resume['title']) or 'resume'}.{format_type}"
             try:
-                # Create a new Document
-                doc = Document()
-                
-                # Add name as title
-                doc.add_heading(name, 0)
-                
-                # Add contact info
-                doc.add_paragraph(contact)
-                
-                # Add sections
-                for section in sections:
-                    if section['content'].strip():
-                        doc.add_heading(section['section_name'], 1)
-                        doc.add_paragraph(section['content'])
-                
-                # Save to BytesIO
-                file_stream = BytesIO()
-                doc.save(file_stream)
-                file_stream.seek(0)
-                
-                response = make_response(file_stream.read())
-                response.headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-                response.headers['Content-Disposition'] = f'attachment; filename={resume["title"]}.docx'
-                
-                conn.close()
-                return response
+                archive.writestr(filename, future.result())
             except Exception as e:
-                flash(f'Error generating DOCX: {str(e)}')
-                conn.close()
-                return redirect(url_for('export_resume', resume_id=resume_id))
-                
-        else:
-            # HTML preview
-            conn.close()
-            return render_template('preview_resume.html', resume=resume, html_content=full_html)
+                errors.append(f'{filename}: {str(e)}')
+            yield output.drain()
+        
+        if errors:
+            archive.writestr('errors.txt', '\n'.join(errors))
     
-    # If we get here, it's a GET request without format_type, so show the export options page
-    conn.close()
-    return render_template('export_resume.html', resume=resume, templates=templates)
+    # Central directory is written when the archive closes
+    yield output.drain()
+
+@app.route('/api/export_bulk', methods=['POST'])
+@login_required
+def api_export_bulk():
+    resume_ids = request.json.get('resume_ids') or []
+    format_type = request.json.get('format_type', 'pdf')
+    template_id = request.json.get('template_id', 1)
+    
+    if not isinstance(resume_ids, list) or not resume_ids:
+        return jsonify({'error': 'resume_ids must be a non-empty list'}), 400
+    if len(resume_ids) > EXPORT_BULK_MAX:
+        return jsonify({'error': f'At most {EXPORT_BULK_MAX} resumes can be exported at once'}), 400
+    if format_type not in EXPORT_MIMETYPES:
+        return jsonify({'error': f"format_type must be one of: {', '.join(EXPORT_MIMETYPES)}"}), 400
+    
+    conn = get_db()
+    template = resume_templates.get(template_id)
+    if not template:
+        return jsonify({'error': 'Template not found'}), 404
     
+    try:
+        resume_ids = list(dict.fromkeys(int(resume_id) for resume_id in resume_ids))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'resume_ids must be integers'}), 400
+    
+    # One query for every requested resume the user owns, kept in request order
+    placeholders = ','.join('?' * len(resume_ids))
+    rows = conn.execute(
+        f'SELECT * FROM resumes WHERE user_id = ? AND id IN ({placeholders})',
+        [session['user_id']] + resume_ids
+    ).fetchall()
+    by_id = {row['id']: row for row in rows}
+    resumes = [by_id[resume_id] for resume_id in resume_ids if resume_id in by_id]
+    
+    if not resumes:
+        return jsonify({'error': 'No matching resumes found'}), 404
+    
+    response = Response(stream_bulk_export(resumes, template, format_type), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename=resumes-{format_type}.zip'
+    return response
+
 @app.route('/api/get_response', methods=['POST'])
 @login_required
-def api_get_response():
+async def api_get_response():
     user_input = request.json.get('prompt')
     resume_id = request.json.get('resume_id')
+    fresh = bool(request.json.get('fresh', False))
     
     context = ""
     if resume_id:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM resumes WHERE id = ? AND user_id = ?', (resume_id, session['user_id']))
-        resume = cursor.fetchone()
+        resume = await run_in_db(get_owned_resume, session['user_id'], resume_id)
         
         if resume:
-            context = f"User is working on a resume titled '{resume['title']}'"
-            if resume['target_job']:
-                context += f" for the position of {resume['target_job']}"
+            context = build_resume_context(resume)
         
-        conn.close()
+        # Don't hold a pooled connection while waiting on the model
+        release_db(None)
     
     try:
-        completion = create_chat_completion(user_input, context)
+        completion = await create_chat_completion_async(user_input, context, use_cache=not fresh, user_id=session['user_id'])
         response_text = completion['choices'][0]['message']['content']
         return jsonify({'response': response_text})
+    except LLMQueueFull as e:
+        return jsonify({'error': str(e)}), e.status_code, {'Retry-After': str(e.retry_after)}
+    except LLMServiceUnavailable as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/stream_response', methods=['POST'])
+@login_required
+def api_stream_response():
+    user_input = request.json.get('prompt')
+    resume_id = request.json.get('resume_id')
+    user_id = session['user_id']
+    
+    if not user_input:
+        return jsonify({'error': 'No prompt provided'}), 400
+    
+    context = ""
+    history = []
+    resume = None
+    if resume_id:
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM resumes WHERE id = ? AND user_id = ?', (resume_id, user_id))
+        resume = cursor.fetchone()
+        
+        if resume:
+            cursor.execute('SELECT * FROM resume_sections WHERE resume_id = ? ORDER BY position', (resume_id,))
+            sections = cursor.fetchall()
+            conversation_id = get_conversation_id(conn, user_id, resume_id, create=False)
+            try:
+                context, history = build_chat_context(conn, conversation_id, resume, sections, user_input, user_id)
+            except Exception:
+                # Fall back to a single-turn prompt rather than failing the stream
+                context = build_resume_context(resume)
+    
+    # Queue before the stream starts so a full queue can still answer with a proper status
+    try:
+        ticket = llm_scheduler.acquire(LLM_TASKS['chat'], user_id)
+    except LLMQueueFull as e:
+        return jsonify({'error': str(e)}), e.status_code, {'Retry-After': str(e.retry_after)}
+    
+    def generate():
+        fragments = []
+        try:
+            for fragment in stream_chat_completion(user_input, context, history=history, ticket=ticket):
+                fragments.append(fragment)
+                yield sse_event({'token': fragment})
+        except Exception as e:
+            yield sse_event({'error': str(e)}, event='error')
+            return
+        
+        ai_response = ''.join(fragments)
+        # Persist the full reply once the stream has finished
+        if resume:
+            save_conversation_turn(user_id, resume['id'], user_input, ai_response)
+        yield sse_event({'response': ai_response}, event='done')
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Gives the slot back even if the client leaves before the stream starts
+    response.call_on_close(ticket.release)
+    return response
+
+@app.route('/api/resume/<int:resume_id>/messages')
+@login_required
+def api_resume_messages(resume_id):
+    before_seq = request.args.get('before', type=int)
+    # SQLite treats a negative LIMIT as no limit
+    limit = max(1, min(request.args.get('limit', CHAT_HISTORY_PAGE_SIZE, type=int), 200))
+    
+    conn = get_db()
+    conversation_id = get_conversation_id(conn, session['user_id'], resume_id, create=False)
+    if conversation_id is None:
+        return jsonify({'messages': [], 'has_more': False})
+    
+    messages = load_messages(conn, conversation_id, limit=limit, before_seq=before_seq)
+    return jsonify({
+        'messages': [dict(message) for message in messages],
+        'has_more': bool(messages) and messages[0]['seq'] > 1
+    })
+
 @app.route('/api/check_grammar', methods=['POST'])
 @login_required
 def api_check_grammar():
@@ -1211,9 +3931,48 @@ def api_optimize_ats():
     if not resume_text or not job_description:
         return jsonify({'error': 'Missing required parameters'}), 400
 
+    conn = get_db()
+    save_job_description(conn, session['user_id'], job_description)
+    conn.commit()
+    
     result = optimize_for_ats(resume_text, job_description)
     return jsonify({'result': result})
 
+@app.route('/api/match_job', methods=['POST'])
+@login_required
+def api_match_job():
+    job_description = request.json.get('job_description', '')
+    
+    if not job_description.strip():
+        return jsonify({'error': 'No job description provided'}), 400
+    
+    conn = get_db()
+    save_job_description(conn, session['user_id'], job_description)
+    conn.commit()
+    
+    # Rank every one of the user's resumes against the job description in one pass
+    ranking = rank_resumes(conn, job_description, top_k=None, user_id=session['user_id'])
+    return jsonify({'keywords': ranking['keywords'], 'results': ranking['results']})
+
+@app.route('/api/rank_resumes', methods=['POST'])
+@login_required
+def api_rank_resumes():
+    job_description = request.json.get('job_description', '')
+    
+    if not job_description.strip():
+        return jsonify({'error': 'No job description provided'}), 400
+    
+    try:
+        top_k = min(max(int(request.json.get('top_k', RANK_TOP_K)), 1), RANK_MAX_TOP_K)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'top_k must be an integer'}), 400
+    
+    conn = get_db()
+    save_job_description(conn, session['user_id'], job_description)
+    conn.commit()
+    
+    return jsonify(rank_resumes(conn, job_description, top_k=top_k, user_id=session['user_id']))
+
 
 @app.route('/api/score_resume', methods=['POST'])
 @login_required
@@ -1227,6 +3986,20 @@ def api_score_resume():
     result = score_resume(resume_text, job_title)
     return jsonify({'result': result})
 
+@app.route('/api/v2/score_resume', methods=['POST'])
+@login_required
+async def api_score_resume_v2():
+    """Detailed scoring feedback, blended with the model's job fit when a job title is given"""
+    resume_text = request.json.get('resume_text', '')
+    job_title = request.json.get('job_title', '')
+    
+    if not resume_text:
+        return jsonify({'error': 'No resume text provided'}), 400
+    
+    job_fit = await assess_job_fit(resume_text, job_title, session['user_id']) if job_title else None
+    result = await asyncio.to_thread(score_resume_for_job, resume_text, job_fit)
+    return jsonify({'result': result})
+
 @app.route('/api/analyze_sentiment', methods=['POST'])
 @login_required
 def api_analyze_sentiment():
@@ -1235,9 +4008,56 @@ def api_analyze_sentiment():
     if not text:
         return jsonify({'error': 'No text provided'}), 400
 
-    result = analyze_sentiment(text)
+    try:
+        result = analyze_sentiment(text)
+    except RuntimeError as e:
+        # NLTK data is missing and could not be downloaded
+        return jsonify({'error': str(e)}), 503
     return jsonify({'result': result})
 
+@app.route('/api/analyze_sentiment_batch', methods=['POST'])
+@login_required
+def api_analyze_sentiment_batch():
+    texts = request.json.get('texts')
+    resume_id = request.json.get('resume_id')
+    
+    try:
+        get_sentiment_analyzer()
+    except RuntimeError as e:
+        # NLTK data is missing and could not be downloaded
+        return jsonify({'error': str(e)}), 503
+    
+    if resume_id:
+        # Score every section of one of the user's resumes
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id FROM resumes WHERE id = ? AND user_id = ?', (resume_id, session['user_id']))
+        if not cursor.fetchone():
+            return jsonify({'error': 'Resume not found'}), 404
+        
+        cursor.execute('SELECT id, section_name, content FROM resume_sections WHERE resume_id = ? ORDER BY position', (resume_id,))
+        sections = cursor.fetchall()
+        results = analyze_sentiment_batch([section['content'] for section in sections])
+        return jsonify({'result': [
+            dict(result, section_id=section['id'], section_name=section['section_name'])
+            for section, result in zip(sections, results)
+        ]})
+    
+    if not texts or not isinstance(texts, list):
+        return jsonify({'error': 'Provide a list of texts or a resume_id'}), 400
+    
+    return jsonify({'result': analyze_sentiment_batch([str(text) for text in texts])})
+
+@app.route('/api/llm_cache_stats')
+@login_required
+def api_llm_cache_stats():
+    return jsonify({
+        'result': completion_cache.get_stats(),
+        'coalescing': llm_flights.get_stats(),
+        'scheduler': llm_scheduler.get_stats(),
+        'backends': llm_router.get_stats()
+    })
+
 @app.errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
@@ -1246,5 +4066,611 @@ def page_not_found(e):
 def internal_server_error(e):
     return render_template('500.html'), 500
 
+# Benchmarks
+def time_queries(conn, sql, params_list):
+    """Run a query once per parameter tuple and return (median, p95) latency in ms"""
+    timings = []
+    for params in params_list:
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+@app.cli.command('bench-queries')
+@click.option('--users', default=100000, help='Number of users to generate')
+@click.option('--sections', default=1000000, help='Number of resume sections to generate')
+@click.option('--samples', default=200, help='Queries timed per hot path')
+def bench_queries(users, sections, samples):
+    """Time the hot queries on a synthetic database before and after the index migrations"""
+    rng = random.Random(0)
+    resumes_per_user = 2
+    resume_count = users * resumes_per_user
+    sections_per_resume = max(1, sections // resume_count)
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'bench.db')
+        init_db(path, migrate=False)
+        conn = get_db_connection(path)
+        
+        click.echo(f'Generating {users} users, {resume_count} resumes, {resume_count * sections_per_resume} sections...')
+        conn.executemany(
+            'INSERT INTO users (id, username, email, password) VALUES (?, ?, ?, ?)',
+            ((i, f'user{i}', f'user{i}@example.com', 'x') for i in range(1, users + 1))
+        )
+        conn.executemany(
+            'INSERT INTO resumes (id, user_id, title, content, updated_at) VALUES (?, ?, ?, ?, ?)',
+            ((i, (i - 1) // resumes_per_user + 1, f'Resume {i}', '', f'2024-01-01 00:00:{i % 60:02d}')
+             for i in range(1, resume_count + 1))
+        )
+        conn.executemany(
+            'INSERT INTO resume_sections (resume_id, section_name, content) VALUES (?, ?, ?)',
+            ((resume_id, f'Section {n}', 'Developed and led projects') 
+             for n in range(sections_per_resume) for resume_id in range(1, resume_count + 1))
+        )
+        conn.executemany(
+            'INSERT INTO conversations (user_id, resume_id, messages) VALUES (?, ?, ?)',
+            (((i - 1) // resumes_per_user + 1, i, '[]') for i in range(1, resume_count + 1))
+        )
+        conn.commit()
+        
+        user_ids = [(rng.randint(1, users),) for _ in range(samples)]
+        resume_ids = [(rng.randint(1, resume_count),) for _ in range(samples)]
+        queries = [
+            ('dashboard', 'SELECT * FROM resumes WHERE user_id = ? ORDER BY updated_at DESC', user_ids),
+            ('sections', 'SELECT * FROM resume_sections WHERE resume_id = ?', resume_ids),
+            ('conversation', 'SELECT * FROM conversations WHERE resume_id = ? AND user_id = ? ORDER BY created_at DESC LIMIT 1',
+             [(resume_id, (resume_id - 1) // resumes_per_user + 1) for (resume_id,) in resume_ids]),
+        ]
+        
+        before = {name: time_queries(conn, sql, params) for name, sql, params in queries}
+        start = time.perf_counter()
+        version = run_migrations(conn)
+        migrate_seconds = time.perf_counter() - start
+        after = {name: time_queries(conn, sql, params) for name, sql, params in queries}
+        conn.close()
+    
+    click.echo(f'Migrated to schema version {version} in {migrate_seconds:.1f}s')
+    click.echo(f"{'query':<14}{'before p50':>12}{'before p95':>12}{'after p50':>12}{'after p95':>12}")
+    for name, _, _ in queries:
+        click.echo(f'{name:<14}{before[name][0]:>10.3f}ms{before[name][1]:>10.3f}ms{after[name][0]:>10.3f}ms{after[name][1]:>10.3f}ms')
+
+@app.cli.command('search-resumes')
+@click.argument('query')
+@click.option('--user-id', default=None, type=int, help='Only search resumes owned by this user')
+@click.option('--limit', default=20, help='Number of resumes to list')
+def search_resumes_command(query, user_id, limit):
+    """Search every resume (or one user's) by skill or keyword"""
+    results, has_more = search_resumes(get_db(), query, user_id, limit=limit)
+    for result in results:
+        snippet = result['snippet'].replace('<mark>', '[').replace('</mark>', ']')
+        click.echo(f"#{result['resume_id']} {result['title']} ({result['section_name']}, {result['score']}): {snippet}")
+    if has_more:
+        click.echo('...')
+
+@app.cli.command('bench-search')
+@click.option('--sections', default=1000000, help='Number of resume sections to generate')
+@click.option('--sections-per-resume', default=5, help='Sections in each resume')
+@click.option('--resumes-per-user', default=2, help='Resumes owned by each user')
+@click.option('--samples', default=200, help='Queries timed per case')
+def bench_search(sections, sections_per_resume, resumes_per_user, samples):
+    """Time full-text search against a LIKE scan on a synthetic database"""
+    rng = random.Random(0)
+    vocabulary = list(TECH_SKILLS + ACTION_VERBS + COMMON_KEYWORDS) + [
+        'kubernetes', 'terraform', 'golang', 'rust', 'kafka', 'spark', 'pandas', 'tableau', 'figma', 'salesforce',
+        'customers', 'revenue', 'pipeline', 'platform', 'analytics', 'dashboard', 'migration', 'latency', 'budget',
+        'stakeholders', 'roadmap', 'mentored', 'hiring', 'automated', 'testing', 'deployment', 'security', 'cloud',
+    ] + [f'term{i}' for i in range(2000)]
+    resume_count = max(1, sections // sections_per_resume)
+    users = max(1, resume_count // resumes_per_user)
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'bench.db')
+        init_db(path, migrate=False)
+        conn = get_db_connection(path)
+        
+        click.echo(f'Generating {users} users, {resume_count} resumes, {resume_count * sections_per_resume} sections...')
+        conn.executemany(
+            'INSERT INTO users (id, username, email, password) VALUES (?, ?, ?, ?)',
+            ((i, f'user{i}', f'user{i}@example.com', 'x') for i in range(1, users + 1))
+        )
+        conn.executemany(
+            'INSERT INTO resumes (id, user_id, title, target_job, content) VALUES (?, ?, ?, ?, ?)',
+            ((i, (i - 1) % users + 1, f'Resume {i}', rng.choice(vocabulary[:40]) + ' engineer', '')
+             for i in range(1, resume_count + 1))
+        )
+        conn.executemany(
+            'INSERT INTO resume_sections (resume_id, section_name, content) VALUES (?, ?, ?)',
+            ((resume_id, f'Section {n}', ' '.join(rng.choice(vocabulary) for _ in range(40)))
+             for resume_id in range(1, resume_count + 1) for n in range(sections_per_resume))
+        )
+        conn.commit()
+        
+        start = time.perf_counter()
+        run_migrations(conn)
+        click.echo(f'Migrated and built the search index in {time.perf_counter() - start:.1f}s')
+        
+        terms = [rng.choice(vocabulary) for _ in range(samples)]
+        pairs = [f'{rng.choice(vocabulary[:40])} {rng.choice(vocabulary[40:80])}' for _ in range(samples)]
+        owners = [rng.randint(1, users) for _ in range(samples)]
+        cases = [
+            ('fts user', lambda i: search_resumes(conn, pairs[i], owners[i])),
+            ('fts global', lambda i: search_resumes(conn, terms[i])),
+            ('fts global 2', lambda i: search_resumes(conn, pairs[i])),
+            ('like user', lambda i: conn.execute(
+                'SELECT DISTINCT resume_sections.resume_id FROM resume_sections JOIN resumes ON resumes.id = resume_sections.resume_id '
+                'WHERE resumes.user_id = ? AND resume_sections.content LIKE ?', (owners[i], f'%{terms[i]}%')).fetchall()),
+            ('like global', lambda i: conn.execute(
+                'SELECT DISTINCT resume_id FROM resume_sections WHERE content LIKE ?', (f'%{terms[i]}%',)).fetchall()),
+        ]
+        
+        click.echo(f"{'case':<14}{'p50':>12}{'p95':>12}")
+        for name, run in cases:
+            # LIKE scans are slow enough that a handful of samples is plenty
+            count = samples if name.startswith('fts') else min(samples, 10)
+            timings = []
+            for i in range(count):
+                start = time.perf_counter()
+                run(i)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            click.echo(f'{name:<14}{statistics.median(timings):>10.3f}ms{timings[int(len(timings) * 0.95) - 1]:>10.3f}ms')
+        conn.close()
+
+@app.cli.command('rank-resumes')
+@click.argument('job_file', type=click.File('r'))
+@click.option('--top-k', default=RANK_TOP_K, help='Number of resumes to list')
+@click.option('--chunk-size', default=RANK_CHUNK_SIZE, help='Resumes loaded and scored per batch')
+@click.option('--user-id', default=None, type=int, help="Only rank this user's resumes")
+@click.option('--json', 'as_json', is_flag=True, help='Print the full ranking as JSON')
+def rank_resumes_command(job_file, top_k, chunk_size, user_id, as_json):
+    """Rank stored resumes against the job description in JOB_FILE ('-' for stdin)"""
+    ranking = rank_resumes(get_db(), job_file.read(), top_k=top_k, chunk_size=chunk_size, user_id=user_id)
+    if as_json:
+        click.echo(json.dumps(ranking, indent=2))
+        return
+    
+    click.echo(f"Keywords: {', '.join(ranking['keywords'][:10])}")
+    for position, result in enumerate(ranking['results'], start=1):
+        click.echo(f"{position:>3}. #{result['resume_id']} {result['title']}: {result['score']} "
+                   f"(coverage {result['keyword_coverage']}%, missing: {', '.join(result['missing_terms'][:5])})")
+    click.echo(f"Scored {ranking['scored']} resumes in {ranking['elapsed']:.2f}s = {ranking['resumes_per_sec']:.0f} resumes/sec")
+
+@app.cli.command('bench-rank')
+@click.option('--resumes', default=100000, help='Number of resumes to generate')
+@click.option('--chunk-size', default=RANK_CHUNK_SIZE, help='Resumes loaded and scored per batch')
+def bench_rank(resumes, chunk_size):
+    """Measure batch ranking throughput on a synthetic database"""
+    rng = random.Random(0)
+    vocabulary = list(TECH_SKILLS + ACTION_VERBS + COMMON_KEYWORDS) + [f'term{i}' for i in range(5000)]
+    job_description = ' '.join(rng.choice(vocabulary) for _ in range(150))
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'bench.db')
+        init_db(path)
+        conn = get_db_connection(path)
+        conn.execute("INSERT INTO users (id, username, email, password) VALUES (1, 'bench', 'bench@example.com', 'x')")
+        conn.executemany(
+            'INSERT INTO resumes (user_id, title, content) VALUES (1, ?, ?)',
+            ((f'Resume {i}', '. '.join(' '.join(rng.choice(vocabulary) for _ in range(12)) for _ in range(35)))
+             for i in range(resumes))
+        )
+        conn.commit()
+        
+        start = time.perf_counter()
+        build_match_index(conn)
+        conn.commit()
+        click.echo(f'Indexed {resumes} documents in {time.perf_counter() - start:.1f}s')
+        
+        corpus = MatchCorpus(MATCH_CORPUS_TTL)
+        start = time.perf_counter()
+        corpus.load(conn)
+        click.echo(f'Loaded document frequencies for {corpus.doc_count} documents in {time.perf_counter() - start:.2f}s')
+        
+        ranking = rank_resumes(conn, job_description, chunk_size=chunk_size, corpus=corpus)
+        conn.close()
+    click.echo(f"Scored {ranking['scored']} resumes in {ranking['elapsed']:.2f}s = {ranking['resumes_per_sec']:.0f} resumes/sec")
+
+@app.cli.command('warm-nlp')
+def warm_nlp_command():
+    """Download any missing NLTK data and load the NLP models"""
+    for resource_path, package in NLP_RESOURCES:
+        ensure_nltk_resource(resource_path, package, download=True)
+    get_sentiment_analyzer()
+    click.echo('NLP models ready')
+
+# Sample resume shared by the export benchmarks
+BENCH_RESUME = {'title': 'Benchmark Resume'}
+BENCH_SECTIONS = [
+    {'section_name': 'Personal Information', 'content': 'Jane Doe\njane@example.com\n(555) 123-4567'},
+    {'section_name': 'Work Experience', 'content': '• Developed and launched services used by 2M users\n' * 15},
+    {'section_name': 'Education', 'content': 'B.Sc. Computer Science, 2020'},
+    {'section_name': 'Skills', 'content': 'Python, SQL, Docker, AWS, React'},
+]
+
+@app.cli.command('bench-pdf')
+@click.option('--count', default=50, help='Number of PDFs to render')
+@click.option('--renderer', default=None, help='PDF renderer to use (defaults to PDF_RENDERER)')
+@click.option('--template-id', default=1, help='Template to render with')
+def bench_pdf(count, renderer, template_id):
+    """Measure PDF export throughput on a sample resume"""
+    template = resume_templates.get(template_id)
+    html = build_resume_html(BENCH_RESUME, BENCH_SECTIONS, template)
+    name, _ = get_pdf_renderer(renderer)
+    
+    start = time.perf_counter()
+    for _ in range(count):
+        size = len(render_pdf(html, renderer))
+    elapsed = time.perf_counter() - start
+    click.echo(f'{name}: {count} exports in {elapsed:.2f}s = {count / elapsed:.1f} exports/sec ({size} bytes each)')
+
+@app.cli.command('bench-templates')
+@click.option('--count', default=10000, help='Number of HTML previews to render')
+@click.option('--template-id', default=1, help='Template to render with')
+def bench_templates(count, template_id):
+    """Measure HTML preview rendering throughput with the compiled templates"""
+    template = resume_templates.get(template_id)
+    
+    start = time.perf_counter()
+    for _ in range(count):
+        build_resume_html(BENCH_RESUME, BENCH_SECTIONS, template)
+    elapsed = time.perf_counter() - start
+    click.echo(f'{template.name}: {count} previews in {elapsed:.2f}s = {count / elapsed:.0f} previews/sec')
+
+@app.cli.command('stub-llm')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=1234)
+@click.option('--delay', default=2.0, help='Seconds each completion takes')
+@click.option('--model', default='stub', help='Model name to report and to sign replies with')
+@click.option('--reply', default=None, help='Reply text, one token per word; defaults to naming the model and port')
+@click.option('--token-delay', default=0.0, help='Seconds each token of the reply takes')
+def stub_llm_command(host, port, delay, model, reply, token_delay):
+    """Serve canned chat completions after a fixed delay, standing in for LM Studio in load and routing tests"""
+    import uvicorn
+    
+    async def stub_app(scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        
+        if scope['method'] == 'GET':
+            # Health checks list the models
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/json')]})
+            await send({'type': 'http.response.body', 'body': json.dumps({'data': [{'id': model, 'object': 'model'}]}).encode('utf-8')})
+            return
+        
+        request_data = json.loads(body or b'{}')
+        tokens = re.findall(r'\S+\s*', reply or f'Stub reply from {model} on port {port}')
+        if request_data.get('max_tokens', -1) > 0:
+            tokens = tokens[:request_data['max_tokens']]
+        await asyncio.sleep(delay)
+        
+        if not request_data.get('stream'):
+            await asyncio.sleep(token_delay * len(tokens))
+            payload = {'model': model, 'choices': [{'message': {'role': 'assistant', 'content': ''.join(tokens)}}]}
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/json')]})
+            await send({'type': 'http.response.body', 'body': json.dumps(payload).encode('utf-8')})
+            return
+        
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'text/event-stream')]})
+        for token in tokens:
+            await asyncio.sleep(token_delay)
+            chunk = {'model': model, 'choices': [{'delta': {'content': token}}]}
+            await send({'type': 'http.response.body', 'body': f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'data: [DONE]\n\n'})
+    
+    uvicorn.run(stub_app, host=host, port=port, log_level='warning', lifespan='off')
+
+@app.cli.command('load-test')
+@click.argument('base_url')
+@click.option('--requests', 'total', default=1000, help='Number of chat requests to send')
+@click.option('--concurrency', default=500, help='Chat requests in flight at once')
+@click.option('--users', default=100, help='Accounts the chat requests are spread over')
+@click.option('--username', default='loadtest', help='Prefix for the account names')
+@click.option('--password', default='loadtest')
+@click.option('--timeout', default=300.0, help='Seconds before a request counts as failed')
+def load_test_command(base_url, total, concurrency, users, username, password, timeout):
+    """Flood BASE_URL with uncached /api/get_response calls while timing the dashboard alongside them.
+    
+    The server's LLM admission control still applies: each user gets 429 past LLM_USER_QUEUE_DEPTH
+    waiting requests, and everyone gets 503 past LLM_QUEUE_DEPTH. To measure throughput rather than
+    rejections, spread the load over enough --users and start the server with LLM_MAX_CONCURRENCY
+    and LLM_QUEUE_DEPTH sized for --concurrency.
+    """
+    csrf_re = re.compile(r'name="csrf_token" value="([^"]+)"')
+    
+    def summarize(label, timings):
+        if not timings:
+            return f'{label}: no responses'
+        timings = sorted(timings)
+        return (f'{label}: p50 {statistics.median(timings):.2f}s, p95 {timings[int(len(timings) * 0.95) - 1]:.2f}s, '
+                f'max {timings[-1]:.2f}s')
+    
+    async def log_in(client, name):
+        # Any form page carries a session-bound CSRF token; it also covers the JSON calls
+        async with client.get('/login') as response:
+            token = csrf_re.search(await response.text()).group(1)
+        credentials = {'csrf_token': token, 'username': name, 'password': password}
+        async with client.post('/register', data=dict(credentials, email=f'{name}@example.com')):
+            pass
+        async with client.post('/login', data=credentials):
+            pass
+        async with client.get('/dashboard', allow_redirects=False) as response:
+            if response.status != 200:
+                raise click.ClickException(f'Could not log in as {name}')
+        return token
+    
+    async def run():
+        connector = aiohttp.TCPConnector(limit=concurrency + 1)
+        # One session per user for its cookies, all sharing the connection pool; unsafe lets the
+        # cookie jar keep the session cookie for an IP address base URL
+        clients = [
+            aiohttp.ClientSession(base_url=base_url, cookie_jar=aiohttp.CookieJar(unsafe=True), connector=connector,
+                                  connector_owner=False, timeout=aiohttp.ClientTimeout(total=timeout))
+            for _ in range(users)
+        ]
+        try:
+            tokens = await asyncio.gather(*(log_in(client, f'{username}-{index}') for index, client in enumerate(clients)))
+            
+            chat_timings, dashboard_timings, statuses = [], [], Counter()
+            pending = iter(range(total))
+            in_flight = 0
+            peak = 0
+            
+            async def chat_worker(worker):
+                nonlocal in_flight, peak
+                client, token = clients[worker % users], tokens[worker % users]
+                for index in pending:
+                    in_flight += 1
+                    peak = max(peak, in_flight)
+                    start = time.perf_counter()
+                    try:
+                        async with client.post('/api/get_response', headers={'X-CSRFToken': token},
+                                               json={'prompt': f'Load test {index}', 'fresh': True}) as response:
+                            await response.read()
+                        statuses[response.status] += 1
+                        chat_timings.append(time.perf_counter() - start)
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        statuses[type(e).__name__] += 1
+                    in_flight -= 1
+            
+            async def dashboard_probe():
+                # A cheap page requested once a second shows whether it queues behind the chats
+                while True:
+                    start = time.perf_counter()
+                    try:
+                        async with clients[0].get('/dashboard') as response:
+                            await response.read()
+                        dashboard_timings.append(time.perf_counter() - start)
+                    except (aiohttp.ClientError, asyncio.TimeoutError):
+                        pass
+                    await asyncio.sleep(1)
+            
+            start = time.perf_counter()
+            probe = asyncio.create_task(dashboard_probe())
+            await asyncio.gather(*(chat_worker(worker) for worker in range(concurrency)))
+            probe.cancel()
+            elapsed = time.perf_counter() - start
+        finally:
+            for client in clients:
+                await client.close()
+            await connector.close()
+        
+        click.echo(f'{total} chat requests from {users} users, {peak} in flight at peak, in {elapsed:.1f}s = {total / elapsed:.1f} req/s')
+        click.echo(f"Statuses: {', '.join(f'{status}={count}' for status, count in sorted(statuses.items(), key=str))}")
+        click.echo(summarize('Chat latency', chat_timings))
+        click.echo(summarize('Dashboard latency', dashboard_timings))
+    
+    asyncio.run(run())
+
+# ASGI serving mode: `uvicorn app:asgi_app`
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 16))
+# The Flask minor version ASGIApp.dispatch_async was written against
+FLASK_DISPATCH_VERSION = '3.1.'
+
+def build_wsgi_environ(scope, body):
+    """Translate an ASGI HTTP scope and its request body into a WSGI environ"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+def encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+class ASGIApp:
+    """ASGI front end for the Flask app.
+    
+    Requests for async views are dispatched on the server's event loop, so thousands of them can wait
+    on LM Studio without holding a thread. Every other view runs on a bounded thread pool, as it would
+    under a threaded WSGI server.
+    """
+    
+    def __init__(self, flask_app, threads):
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+        # dispatch_async mirrors one Flask minor version; on any other, async views take Flask's own path
+        flask_version = importlib.metadata.version('flask')
+        self.dispatch_on_loop = flask_version.startswith(FLASK_DISPATCH_VERSION)
+        if not self.dispatch_on_loop:
+            flask_app.logger.warning(
+                "Flask %s is not %sx; async views will hold a pool thread while they wait", flask_version, FLASK_DISPATCH_VERSION
+            )
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+        
+        body = bytearray()
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        environ = build_wsgi_environ(scope, bytes(body))
+        
+        if self.dispatch_on_loop and self.is_async_view(environ):
+            await self.dispatch_async(environ, send)
+        else:
+            # Through asgiref, any coroutine Flask's ensure_sync starts on the pool thread runs on
+            # this loop, where the shared LLM session lives
+            run_wsgi = sync_to_async(self.run_wsgi, thread_sensitive=False, executor=self.executor)
+            await run_wsgi(environ, send, asyncio.get_running_loop())
+    
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    start_background_services()
+                except RuntimeError as e:
+                    # e.g. NLTK data missing under NLP_OFFLINE; the server refuses to start
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await llm_router.open()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await llm_router.close()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    def is_async_view(self, environ):
+        try:
+            endpoint, _ = self.flask_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            # Let Flask render the 404/405 on the thread pool
+            return False
+        return inspect.iscoroutinefunction(self.flask_app.view_functions[endpoint])
+    
+    # dispatch_async and full_dispatch_request copy Flask 3.1's wsgi_app and full_dispatch_request
+    # with the view awaited. requirements.txt pins Flask to 3.1.x, and __init__ turns them off on any
+    # other version; recheck them against Flask's own before moving the pin. Signals, hooks and
+    # error handling all match: request_started is sent here, and handle_exception sends
+    # got_request_exception. Deliberately left out are the private _got_first_request flag, which
+    # only feeds Flask's late-setup warnings, and the debugger's werkzeug.debug.preserve_context,
+    # which only the development server sets.
+    async def dispatch_async(self, environ, send):
+        """Flask's wsgi_app, awaiting the view on this event loop instead of in a loop of its own"""
+        ctx = self.flask_app.request_context(environ)
+        error = None
+        try:
+            try:
+                ctx.push()
+                response = await self.full_dispatch_request()
+            except Exception as e:
+                error = e
+                response = self.flask_app.handle_exception(e)
+            # Async views return buffered responses, so the body is read before the context closes
+            app_iter, status, headers = response.get_wsgi_response(environ)
+            body = b''.join(app_iter)
+        finally:
+            if error is not None and self.flask_app.should_ignore_error(error):
+                error = None
+            ctx.pop(error)
+        
+        await send({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                    'headers': encode_headers(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+    
+    async def full_dispatch_request(self):
+        flask_app = self.flask_app
+        try:
+            request_started.send(flask_app, _async_wrapper=flask_app.ensure_sync)
+            rv = flask_app.preprocess_request()
+            if rv is None:
+                if request.routing_exception is not None:
+                    flask_app.raise_routing_exception(request)
+                if request.url_rule.provide_automatic_options and request.method == 'OPTIONS':
+                    rv = flask_app.make_default_options_response()
+                else:
+                    rv = await flask_app.view_functions[request.endpoint](**request.view_args)
+        except Exception as e:
+            rv = flask_app.handle_user_exception(e)
+        return flask_app.finalize_request(rv)
+    
+    def run_wsgi(self, environ, send, loop):
+        """Run a request through the WSGI app on a pool thread, streaming its body back to the event loop"""
+        def send_from_thread(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+        
+        def start_response(status, headers, exc_info=None):
+            send_from_thread({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                              'headers': encode_headers(headers)})
+        
+        app_iter = self.flask_app(environ, start_response)
+        try:
+            for chunk in app_iter:
+                if chunk:
+                    send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            send_from_thread({'type': 'http.response.body'})
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+asgi_app = ASGIApp(app, ASGI_WSGI_THREADS)
+
+# Initialize database on startup, once every migration step it may run is defined
+init_db()
+
+# Background work starts with the server rather than on import, so CLI commands don't pay for it
+_background_lock = threading.Lock()
+_background_started = False
+
+def start_background_services():
+    """Start the job workers and LLM health checks and load the NLP models, once per process"""
+    global _background_started
+    with _background_lock:
+        if _background_started:
+            return
+        if NLP_OFFLINE:
+            # Fail at startup rather than on the first request that needs the data
+            check_nlp_resources()
+        _background_started = True
+        job_queue.start()
+        llm_router.start()
+        if NLP_WARM_UP:
+            warm_up_nlp()
+
+@app.before_request
+def ensure_background_services():
+    # WSGI servers have no startup hook, so the first request starts them
+    if not _background_started:
+        start_background_services()
+
 if __name__ == '__main__':
+    start_background_services()
     app.run(debug=True)
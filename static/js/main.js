@@ -53,31 +53,21 @@ function initializeChat() {
         // Get resume ID from the form
         const resumeId = chatForm.dataset.resumeId;
         
-        // Send request to server
-        fetch('/api/get_response', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
+        // Stream the reply into an empty assistant message as tokens arrive
+        const replyDiv = addMessage('assistant', '');
+        let reply = '';
+        
+        streamChatResponse({ prompt: message, resume_id: resumeId }, {
+            onToken: function(token) {
+                reply += token;
+                replyDiv.innerHTML = reply.replace(/\n/g, '<br>');
+                scrollToBottom();
             },
-            body: JSON.stringify({
-                prompt: message,
-                resume_id: resumeId
-            }),
-        })
-        .then(response => response.json())
-        .then(data => {
-            if (data.error) {
-                addMessage('assistant', 'Sorry, there was an error: ' + data.error);
-            } else {
-                addMessage('assistant', data.response);
+            onError: function(error) {
+                console.error('Error:', error);
+                replyDiv.innerHTML = 'Sorry, there was an error: ' + error;
+                scrollToBottom();
             }
-            // Scroll to bottom
-            scrollToBottom();
-        })
-        .catch(error => {
-            console.error('Error:', error);
-            addMessage('assistant', 'Sorry, there was an error processing your request.');
-            scrollToBottom();
         });
     });
     
@@ -92,6 +82,7 @@ function initializeChat() {
         
         messagesContainer.appendChild(messageDiv);
         scrollToBottom();
+        return messageDiv;
     }
     
     // Function to scroll the chat to the bottom
@@ -117,6 +108,92 @@ function initializeChat() {
     }
 }
 
+/**
+ * JSON request headers, with the page's CSRF token when it has one
+ */
+function jsonHeaders(extra) {
+    const headers = Object.assign({ 'Content-Type': 'application/json' }, extra || {});
+    const csrfInput = document.querySelector('input[name="csrf_token"]');
+    if (csrfInput) {
+        headers['X-CSRFToken'] = csrfInput.value;
+    }
+    return headers;
+}
+
+/**
+ * Stream an assistant reply from /api/stream_response (Server-Sent Events)
+ * Calls handlers.onToken for each fragment, handlers.onDone with the full
+ * reply and handlers.onError with a message if the stream fails
+ */
+function streamChatResponse(payload, handlers) {
+    const headers = jsonHeaders({ 'Accept': 'text/event-stream' });
+    
+    const onToken = handlers.onToken || function() {};
+    const onDone = handlers.onDone || function() {};
+    const onError = handlers.onError || function() {};
+    
+    function handleEvent(frame) {
+        let event = 'message';
+        let data = '';
+        frame.split('\n').forEach(line => {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                data += line.slice(5).trim();
+            }
+        });
+        if (!data) return;
+        
+        const parsed = JSON.parse(data);
+        if (event === 'error') {
+            onError(parsed.error);
+        } else if (event === 'done') {
+            onDone(parsed.response);
+        } else if (parsed.token) {
+            onToken(parsed.token);
+        }
+    }
+    
+    return fetch('/api/stream_response', {
+        method: 'POST',
+        headers: headers,
+        body: JSON.stringify(payload),
+    })
+    .then(response => {
+        if (!response.ok || !response.body) {
+            throw new Error('Network response was not ok: ' + response.status);
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        function read() {
+            return reader.read().then(({ done, value }) => {
+                if (done) {
+                    if (buffer.trim()) handleEvent(buffer);
+                    return;
+                }
+                buffer += decoder.decode(value, { stream: true });
+                
+                // SSE frames are separated by a blank line
+                let boundary = buffer.indexOf('\n\n');
+                while (boundary !== -1) {
+                    handleEvent(buffer.slice(0, boundary));
+                    buffer = buffer.slice(boundary + 2);
+                    boundary = buffer.indexOf('\n\n');
+                }
+                return read();
+            });
+        }
+        
+        return read();
+    })
+    .catch(error => {
+        onError(error.message);
+    });
+}
+
 /**
  * Initialize real-time grammar checker
  */
@@ -213,9 +290,7 @@ function initializeSectionManager() {
         
         fetch('/api/add_section', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
+            headers: jsonHeaders(),
             body: JSON.stringify({
                 resume_id: resumeId,
                 section_name: sectionName
@@ -249,9 +324,7 @@ function initializeSectionManager() {
             
             fetch('/api/delete_section', {
                 method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
+                headers: jsonHeaders(),
                 body: JSON.stringify({
                     section_id: sectionId
                 }),
@@ -312,9 +385,7 @@ function initializeSectionManager() {
         
         fetch('/api/update_sections_order', {
             method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
+            headers: jsonHeaders(),
             body: JSON.stringify({
                 resume_id: resumeId,
                 section_ids: sectionIds